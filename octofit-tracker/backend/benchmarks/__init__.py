@@ -0,0 +1,26 @@
+"""
+Performance benchmarks for the octofit backend.
+
+Run from the backend directory, e.g. ``python -m benchmarks.serializers``.
+"""
+import os
+import time
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+    django.setup()
+
+
+def best_of(function, repeat=5):
+    """
+    Smallest wall time of `repeat` calls, in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
@@ -0,0 +1,230 @@
+"""
+Drive every router endpoint with concurrent clients and report latency percentiles.
+
+    python -m benchmarks.api --users 2000 --clients 8 --requests 400 --output before.json
+    python -m benchmarks.api --skip-seed --output after.json --compare before.json
+
+Requests go through Django's test client in-process, against a local mongod
+(MONGODB_URI, loopback only) and a dedicated database that is reseeded with
+``populate_db`` unless --skip-seed is given. For each registered viewset the
+list, retrieve and create endpoints are measured; results are written as JSON
+and --compare reports the change against an earlier run, exiting with status
+1 when a latency or throughput regression exceeds --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import count
+
+import django
+from django.conf import settings
+
+from . import setup
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+PERCENTILES = (50, 95, 99)
+_sequence = count()
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an ascending list
+    """
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[index]
+
+
+def create_payloads(rng, user_ids, team_names):
+    """
+    {basename: () -> POST body} for every viewset the router registers
+    """
+    def unique():
+        return f'{next(_sequence)}-{rng.getrandbits(32):08x}'
+
+    return {
+        'user': lambda: {'name': f'Bench User {unique()}', 'email': f'bench-{unique()}@example.com',
+                         'password': 'benchmark', 'team': rng.choice(team_names)},
+        'team': lambda: {'name': f'Bench Team {unique()}', 'description': 'Benchmark team', 'members': []},
+        'activity': lambda: {'user_id': rng.choice(user_ids), 'type': rng.choice(['running', 'cycling', 'yoga']),
+                             'duration': rng.randint(15, 120), 'distance': round(rng.uniform(0, 20), 2),
+                             'calories': rng.randint(100, 800), 'date': datetime.now(timezone.utc).isoformat(),
+                             'notes': 'Benchmark'},
+        'leaderboard': lambda: {'user_id': f'{rng.getrandbits(96):024x}', 'team': rng.choice(team_names),
+                                'total_calories': rng.randint(0, 5000), 'total_duration': rng.randint(0, 600),
+                                'total_distance': round(rng.uniform(0, 100), 2), 'rank': 1},
+        'workout': lambda: {'name': f'Bench Workout {unique()}', 'type': 'strength', 'duration': 30,
+                            'difficulty': 'medium', 'description': 'Benchmark workout', 'exercises': ['squats']},
+    }
+
+
+def scenarios(rng, db):
+    """
+    (name, method, path factory, body factory) for list, retrieve and create of every viewset
+    """
+    from octofit_tracker.urls import router
+
+    user_ids = [str(user['_id']) for user in db.users.find({}, {'_id': 1}).limit(1000)]
+    team_names = [team['name'] for team in db.teams.find({}, {'name': 1})] or ['Team Marvel']
+    payloads = create_payloads(rng, user_ids, team_names)
+    for prefix, viewset, basename in router.registry:
+        collection = viewset.queryset.model._meta.db_table
+        ids = [str(document['_id']) for document in db[collection].find({}, {'_id': 1}).limit(1000)]
+        yield f'GET /api/{prefix}/', 'get', lambda prefix=prefix: f'/api/{prefix}/', None
+        if ids:
+            yield (f'GET /api/{prefix}/{{id}}/', 'get',
+                   lambda prefix=prefix, ids=ids: f'/api/{prefix}/{rng.choice(ids)}/', None)
+        if basename in payloads:
+            yield f'POST /api/{prefix}/', 'post', lambda prefix=prefix: f'/api/{prefix}/', payloads[basename]
+
+
+def run_scenario(method, path, body, requests, clients, warmup):
+    """
+    Issue `requests` calls from `clients` threads; returns the result record
+    """
+    from django.db import connections
+    from django.test import Client
+
+    def worker(calls):
+        client = Client()
+        timings, errors = [], 0
+        try:
+            for _ in range(calls):
+                kwargs = {'data': json.dumps(body()), 'content_type': 'application/json'} if body else {}
+                url = path()
+                start = time.perf_counter()
+                response = getattr(client, method)(url, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - start)
+                errors += response.status_code >= 400
+        finally:
+            connections.close_all()
+        return timings, errors
+
+    worker(warmup)
+    shares = [requests // clients + (index < requests % clients) for index in range(clients)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        outcomes = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(timing for worker_timings, _ in outcomes for timing in worker_timings)
+    result = {
+        'requests': len(timings),
+        'errors': sum(errors for _, errors in outcomes),
+        'throughput': round(len(timings) / elapsed, 1),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+    }
+    for percent in PERCENTILES:
+        result[f'p{percent}_ms'] = round(percentile(timings, percent) * 1000, 3)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change per scenario; returns the number of regressions beyond `threshold` percent
+    """
+    regressions = 0
+    print(f'\nCompared with {baseline["meta"]["started"]} (threshold {threshold:g}%)')
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print(f'  {name:<32} new')
+            continue
+        changes = []
+        for metric in [f'p{percent}_ms' for percent in PERCENTILES] + ['throughput']:
+            change = (current[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else 0.0
+            # Latency regresses upwards, throughput downwards.
+            regressed = change > threshold if metric != 'throughput' else change < -threshold
+            regressions += regressed
+            changes.append(f'{metric} {change:+6.1f}%{" !" if regressed else "  "}')
+        print(f'  {name:<32} ' + '  '.join(changes))
+    return regressions
+
+
+def check_local(uri):
+    from pymongo.uri_parser import parse_uri
+
+    remote = [host for host, _ in parse_uri(uri)['nodelist'] if host not in LOCAL_HOSTS]
+    if remote:
+        sys.exit(f'Refusing to benchmark against non-local MongoDB hosts: {", ".join(remote)}')
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument('--database', default='octofit_benchmark', help='Database to seed and query')
+    parser.add_argument('--users', type=int, default=1000, help='Synthetic users to seed')
+    parser.add_argument('--activities-per-user', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse the data already in --database')
+
+
+def prepare_database(args):
+    """
+    Point Django at the benchmark database, set it up and seed it; returns the pymongo Database
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+    # Both must be set before the first connection is opened.
+    settings.DATABASES['default']['NAME'] = args.database
+    settings.DEBUG = False  # DEBUG keeps every query in memory
+    check_local(settings.DATABASES['default'].get('CLIENT', {}).get('host', 'mongodb://localhost:27017/'))
+    setup()
+    from django.core.management import call_command
+    from octofit_tracker.mongo import get_db
+
+    if not args.skip_seed:
+        print(f'Seeding {args.database} with {args.users} users...')
+        call_command('populate_db', users=args.users, activities_per_user=args.activities_per_user,
+                     seed=args.seed, verbosity=0)
+    return get_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_dataset_arguments(parser)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint')
+    parser.add_argument('--only', default=None, help='Run only scenarios whose name contains this text')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='Earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    args = parser.parse_args()
+
+    db = prepare_database(args)
+    rng = random.Random(args.seed)
+    meta = {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'documents': {name: db[name].estimated_document_count() for name in ('users', 'activities', 'leaderboard')},
+        **{name: getattr(args, name) for name in ('database', 'users', 'activities_per_user', 'seed', 'clients',
+                                                  'requests', 'warmup')},
+    }
+    print(f'{args.clients} clients, {args.requests} requests per endpoint')
+    print(f'  {"endpoint":<32} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    results = {}
+    for name, method, path, body in scenarios(rng, db):
+        if args.only and args.only not in name:
+            continue
+        result = results[name] = run_scenario(method, path, body, args.requests, args.clients, args.warmup)
+        print(f'  {name:<32} {result["throughput"]:>9,.1f} {result["p50_ms"]:>9.2f} '
+              f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["errors"]:>7}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'meta': meta, 'results': results}, output, indent=2)
+        print(f'Results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Concurrency of the async read endpoints against their sync twins under ASGI.
+
+    python -m benchmarks.async_api --clients 2000 --requests 20000
+
+One event loop plays the role of one ASGI worker: the ASGI application is
+called in-process (no sockets) by --clients concurrent clients, each issuing
+requests back to back until --requests have completed. Every endpoint is run
+through the async route and the sync DRF route, reporting throughput,
+latency percentiles and the peak number of threads the worker needed. The
+dataset comes from the same seeding as ``benchmarks.api``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+from .api import PERCENTILES, add_dataset_arguments, percentile, prepare_database
+
+
+async def call(application, path):
+    """
+    One GET through the ASGI application; returns the status code
+    """
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    finished = asyncio.Event()
+    request_sent = False
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    await application(scope, receive, send)
+    finished.set()
+    return status
+
+
+async def run_scenario(application, paths, requests, clients):
+    remaining = requests
+    timings, errors = [], 0
+    peak_threads = threading.active_count()
+
+    async def client():
+        nonlocal remaining, errors, peak_threads
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await call(application, paths())
+            timings.append(time.perf_counter() - start)
+            errors += status >= 400
+            peak_threads = max(peak_threads, threading.active_count())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    result = {
+        'requests': len(timings),
+        'errors': errors,
+        'throughput': round(len(timings) / elapsed, 1),
+        'peak_threads': peak_threads,
+    }
+    for percent in PERCENTILES:
+        result[f'p{percent}_ms'] = round(percentile(timings, percent) * 1000, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_dataset_arguments(parser)
+    parser.add_argument('--clients', type=int, default=2000, help='Concurrent clients on the one worker')
+    parser.add_argument('--requests', type=int, default=20000, help='Requests per endpoint')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    db = prepare_database(args)
+    from octofit_tracker.asgi import application
+
+    rng = random.Random(args.seed)
+    user_ids = [str(user['_id']) for user in db.users.find({}, {'_id': 1}).limit(1000)]
+    endpoints = {
+        'activities list': ('/api/async/activities/', '/api/activities/'),
+        'leaderboard list': ('/api/async/leaderboard/', '/api/leaderboard/'),
+        'user retrieve': ('/api/async/users/{}/', '/api/users/{}/'),
+    }
+    print(f'{args.clients} concurrent clients, {args.requests} requests per endpoint, one event loop')
+    print(f'  {"endpoint":<28} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"threads":>8} {"errors":>7}')
+    results = {}
+    for name, routes in endpoints.items():
+        for kind, route in zip(('async', 'sync'), routes):
+            paths = (lambda route=route: route.format(rng.choice(user_ids))) if '{}' in route else (lambda route=route: route)
+            result = results[f'{name} ({kind})'] = asyncio.run(
+                run_scenario(application, paths, args.requests, args.clients)
+            )
+            print(f'  {name + " (" + kind + ")":<28} {result["throughput"]:>9,.1f} {result["p50_ms"]:>9.2f} '
+                  f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["peak_threads"]:>8} '
+                  f'{result["errors"]:>7}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'clients': args.clients, 'requests': args.requests, 'results': results}, output, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Payload size and latency of sparse fieldsets against full responses.
+
+    python -m benchmarks.fields --users 2000 --page-size 200 --requests 400
+
+Each endpoint is requested with all fields and with the ?fields= subset a
+mobile client uses, through the same seeded database and threaded test
+client as ``benchmarks.api``. Reported per variant: response bytes of one
+page, latency percentiles and throughput, plus the change of the sparse
+variant against the full one.
+"""
+import argparse
+import json
+import random
+
+from .api import add_dataset_arguments, prepare_database, run_scenario
+
+ENDPOINTS = {
+    'activities list': ('/api/activities/?page_size={page_size}', 'type,duration,date'),
+    'users list': ('/api/users/?page_size={page_size}', '_id,name'),
+    'leaderboard list': ('/api/leaderboard/?page_size={page_size}', 'user_id,total_calories,rank'),
+    'user retrieve': ('/api/users/{user_id}/', 'name,team'),
+}
+
+
+def payload_bytes(path):
+    from django.test import Client
+
+    response = Client().get(path)
+    return len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_dataset_arguments(parser)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=400, help='Requests per variant')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per variant')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    db = prepare_database(args)
+    rng = random.Random(args.seed)
+    user_ids = [str(user['_id']) for user in db.users.find({}, {'_id': 1}).limit(1000)]
+
+    print(f'{args.clients} clients, {args.requests} requests per variant, page size {args.page_size}')
+    print(f'  {"endpoint":<34} {"bytes":>9} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    results = {}
+    for name, (template, fields) in ENDPOINTS.items():
+        variants = {}
+        for variant, suffix in (('full', ''), ('sparse', f'fields={fields}')):
+            def path(template=template, suffix=suffix):
+                url = template.format(page_size=args.page_size, user_id=rng.choice(user_ids))
+                return f'{url}{"&" if "?" in url else "?"}{suffix}' if suffix else url
+
+            result = run_scenario('get', path, None, args.requests, args.clients, args.warmup)
+            result['bytes'] = payload_bytes(path())
+            variants[variant] = result
+            print(f'  {name + " (" + variant + ")":<34} {result["bytes"]:>9,} {result["throughput"]:>9,.1f} '
+                  f'{result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f}')
+        full, sparse = variants['full'], variants['sparse']
+        change = variants['change_percent'] = {
+            key: round((sparse[key] - full[key]) / full[key] * 100, 1) for key in ('bytes', 'p50_ms', 'p95_ms')
+        }
+        print(f'  {"":<34} {change["bytes"]:+}% bytes, {change["p50_ms"]:+}% p50, {change["p95_ms"]:+}% p95')
+        results[name] = variants
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'fields': {name: fields for name, (_, fields) in ENDPOINTS.items()}, 'results': results},
+                      output, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
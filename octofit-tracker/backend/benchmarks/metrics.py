@@ -0,0 +1,61 @@
+"""
+Per-request and per-command cost of the metrics instrumentation.
+
+    python -m benchmarks.metrics --requests 100000
+
+Requests go through MetricsMiddleware around a view that returns at once,
+and command events are fed straight to the listener, so the numbers are the
+instrumentation's own overhead; no database is needed.
+"""
+import argparse
+from types import SimpleNamespace
+
+from . import best_of, setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--commands-per-request', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from octofit_tracker import metrics
+
+    listener = metrics.CommandListener()
+    event = SimpleNamespace(command_name='find', command={'find': 'activities', 'filter': {}}, duration_micros=800)
+    response = HttpResponse()
+
+    def view(request):
+        for _ in range(args.commands_per_request):
+            listener.started(event)
+            listener.succeeded(event)
+        metrics.record_phase('serialize', 0.0001)
+        return response
+
+    request = RequestFactory().get('/api/activities/')
+    request.resolver_match = None
+    middleware = metrics.MetricsMiddleware(view)
+
+    def bare():
+        for _ in range(args.requests):
+            view(request)
+
+    def instrumented():
+        for _ in range(args.requests):
+            middleware(request)
+
+    baseline = best_of(bare, args.repeat)
+    measured = best_of(instrumented, args.repeat)
+    per_request = (measured - baseline) / args.requests * 1e6
+    per_command = best_of(lambda: [listener.succeeded(event) for _ in range(args.requests)], args.repeat)
+    print(f'{args.requests} requests with {args.commands_per_request} commands each, best of {args.repeat}')
+    print(f'  middleware overhead   {per_request:6.2f} us per request')
+    print(f'  listener              {per_command / args.requests * 1e6:6.2f} us per command outside a request')
+
+
+if __name__ == '__main__':
+    main()
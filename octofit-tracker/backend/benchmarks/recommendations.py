@@ -0,0 +1,79 @@
+"""
+Cost of scoring workout recommendations as the workout catalogue grows.
+
+    python -m benchmarks.recommendations --workouts 5000 --users 2000 --threads 8
+
+Workouts and activity histories are synthetic, so no database is needed.
+Reported: the time to build the cached workout matrix, and per request the
+time to turn a user's recent activities into a vector and score every
+workout, single-threaded and from --threads concurrent threads.
+"""
+import argparse
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from . import best_of, setup
+
+ACTIVITY_TYPES = ['running', 'cycling', 'swimming', 'gym', 'yoga', 'walking', 'hiking', 'rowing']
+DIFFICULTIES = ['beginner', 'intermediate', 'advanced']
+
+
+def build_workouts(rng, count):
+    from bson import ObjectId
+
+    return [
+        {'_id': ObjectId(), 'name': f'Workout {index}', 'type': rng.choice(ACTIVITY_TYPES),
+         'duration': rng.choice([15, 20, 30, 45, 60, 75, 90, 120]), 'difficulty': rng.choice(DIFFICULTIES),
+         'description': 'Synthetic workout', 'exercises': ['squats', 'lunges']}
+        for index in range(count)
+    ]
+
+
+def build_histories(rng, users, history):
+    histories = []
+    for _ in range(users):
+        favourites = rng.sample(ACTIVITY_TYPES, 3)
+        histories.append([
+            {'type': rng.choice(favourites), 'duration': rng.randint(15, 120), 'calories': rng.randint(100, 900)}
+            for _ in range(history)
+        ])
+    return histories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workouts', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=50, help='Recent activities per user')
+    parser.add_argument('--limit', type=int, default=10, help='Recommendations per request')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from octofit_tracker.recommendations import WorkoutMatrix
+
+    rng = random.Random(42)
+    workouts = build_workouts(rng, args.workouts)
+    histories = build_histories(rng, args.users, args.history)
+    build = best_of(lambda: WorkoutMatrix(workouts), args.repeat)
+    matrix = WorkoutMatrix(workouts)
+
+    def score(activities):
+        return matrix.top(matrix.user_vector(activities), args.limit)
+
+    single = best_of(lambda: [score(activities) for activities in histories], args.repeat)
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        def concurrent():
+            list(pool.map(score, histories))
+
+        threaded = best_of(concurrent, args.repeat)
+
+    print(f'{args.workouts} workouts, {args.users} users with {args.history} activities, best of {args.repeat}')
+    print(f'  matrix build            {build * 1000:8.2f} ms  ({matrix.vectors.shape[1]} features)')
+    print(f'  score, 1 thread         {single / args.users * 1e6:8.1f} us per request')
+    print(f'  score, {args.threads} threads{"":<8}{threaded / args.users * 1e6:8.1f} us per request (wall)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Encode time and payload size of the API renderers on serializer output.
+
+    python -m benchmarks.renderers --rows 5000
+
+Rows are the unsaved model instances of ``benchmarks.serializers``, so no
+database is needed. Each list is serialized once, then rendered by DRF's
+stock JSONRenderer, ORJSONRenderer and MessagePackRenderer; the orjson
+output is checked against the stock JSON (the rows hold no floats that the
+two spell differently) and the MessagePack output to decode to the same
+values.
+"""
+import argparse
+import json
+
+from . import best_of, setup
+from .serializers import build_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    import msgpack
+    from rest_framework.renderers import JSONRenderer
+    from octofit_tracker.renderers import MessagePackRenderer, ORJSONRenderer
+    from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer
+
+    activities, leaderboard = build_rows(args.rows)
+    renderers = (('stock json', JSONRenderer()), ('orjson', ORJSONRenderer()), ('msgpack', MessagePackRenderer()))
+    print(f'{args.rows} rows, best of {args.repeat}')
+    for serializer_class, rows in ((ActivitySerializer, activities), (LeaderboardSerializer, leaderboard)):
+        data = serializer_class(rows, many=True).data
+        stock = JSONRenderer().render(data)
+        assert ORJSONRenderer().render(data) == stock
+        assert msgpack.unpackb(MessagePackRenderer().render(data)) == json.loads(stock)
+        print(f'  {serializer_class.__name__}')
+        baseline = None
+        for name, renderer in renderers:
+            elapsed = best_of(lambda: renderer.render(data), args.repeat)
+            baseline = baseline or elapsed
+            size = len(renderer.render(data))
+            print(f'    {name:<12} {elapsed * 1000:8.2f} ms  {baseline / elapsed:5.1f}x   '
+                  f'{size / 1024:9.1f} KiB  {size / len(stock):6.1%} of json')
+
+
+if __name__ == '__main__':
+    main()
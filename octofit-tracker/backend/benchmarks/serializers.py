@@ -0,0 +1,61 @@
+"""
+Compare the stock ModelSerializer list output with FastListSerializer.
+
+    python -m benchmarks.serializers --rows 5000
+
+Rows are unsaved model instances, so no database is needed.
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from . import best_of, setup
+
+
+def build_rows(count):
+    from octofit_tracker.models import Activity, Leaderboard
+
+    rng = random.Random(42)
+    activities = [
+        Activity(
+            _id=ObjectId(), user_id=str(ObjectId()), type=rng.choice(['running', 'cycling', 'yoga']),
+            duration=rng.randint(15, 120), distance=round(rng.uniform(0, 20), 2),
+            calories=rng.randint(100, 800), date=datetime(2024, 1, 1) + timedelta(minutes=i),
+            notes='Great session!',
+        )
+        for i in range(count)
+    ]
+    leaderboard = [
+        Leaderboard(
+            _id=ObjectId(), user_id=str(ObjectId()), team='Team Marvel', total_calories=rng.randint(0, 10 ** 5),
+            total_duration=rng.randint(0, 10 ** 4), total_distance=rng.uniform(0, 500), rank=i + 1,
+            last_updated=datetime(2024, 1, 1),
+        )
+        for i in range(count)
+    ]
+    return activities, leaderboard
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from rest_framework import serializers
+    from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer
+
+    activities, leaderboard = build_rows(args.rows)
+    print(f'{args.rows} rows, best of {args.repeat}')
+    for serializer_class, rows in ((ActivitySerializer, activities), (LeaderboardSerializer, leaderboard)):
+        stock = best_of(lambda: serializers.ListSerializer(rows, child=serializer_class()).data, args.repeat)
+        fast = best_of(lambda: serializer_class(rows, many=True).data, args.repeat)
+        print(f'  {serializer_class.__name__:<24} stock {stock * 1000:8.1f} ms   '
+              f'fast {fast * 1000:8.1f} ms   speedup {stock / fast:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
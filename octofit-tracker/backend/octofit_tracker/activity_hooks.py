@@ -0,0 +1,14 @@
+"""
+Propagation of activity writes to the data derived from them.
+
+Every code path that inserts, updates or deletes activities reports the
+change here once per batch, as lists of activity documents (dicts) before
+and after. The change is only queued: ``recompute.worker`` folds it into the
+leaderboard, rollups and team feeds in the background, so the write itself
+does no derived-data maintenance.
+"""
+from . import recompute
+
+
+def activities_changed(added=(), removed=()):
+    recompute.worker.submit(added, removed)
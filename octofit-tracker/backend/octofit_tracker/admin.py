@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, Workout, ActivityRollup
 
 
 @admin.register(User)
@@ -35,3 +35,10 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_display = ['name', 'type', 'duration', 'difficulty']
     search_fields = ['name', 'type', 'difficulty']
     list_filter = ['type', 'difficulty']
+
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ['scope', 'key', 'period', 'bucket', 'type', 'calories', 'duration', 'count']
+    search_fields = ['key']
+    list_filter = ['scope', 'period', 'type']
@@ -0,0 +1,256 @@
+"""
+Per-user activity analytics computed over column arrays.
+
+A user's whole history is read through one projected cursor, in date
+order from the (user_id, date, _id) index, and turned into typed NumPy
+columns (dates, durations, distances, calories) a batch of rows at a time,
+so no single document has to hold it. Streaks, weekly totals with their
+moving averages and personal bests are then computed with vectorized
+operations.
+
+Results are memoized per user (``OCTOFIT_USER_STATS_CACHE_SIZE`` users, least
+recently used evicted) and keyed by the date of the user's latest activity,
+which one covered index lookup reads on every request; the recompute worker
+also drops the entry of every user whose activities changed. The current
+streak, which depends on today's date, and the percentiles against the
+user's team, which depend on teammates' activities (cached per team for
+``OCTOFIT_USER_STATS_TEAM_TTL`` seconds, ``OCTOFIT_USER_STATS_TEAM_CACHE_SIZE``
+teams at most), are filled in per request.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .mongo import get_db
+
+# Weeks in the moving average window and weeks of history returned.
+MOVING_AVERAGE_WEEKS = 4
+WEEKS_RETURNED = 12
+# Day 0 of datetime64 is a Thursday; shifting by 3 makes weeks start on Monday.
+_WEEK_SHIFT = 3
+# Activities converted to column arrays at a time.
+LOAD_BATCH_SIZE = 10000
+
+_lock = threading.Lock()
+_memo = OrderedDict()
+_teams = OrderedDict()
+
+
+def load_columns(user_id):
+    """
+    The user's activities, oldest first, as {dates, durations, distances, calories} arrays
+    """
+    cursor = get_db().activities.find(
+        {'user_id': user_id}, {'_id': 0, 'date': 1, 'duration': 1, 'distance': 1, 'calories': 1},
+        sort=[('date', 1), ('_id', 1)], batch_size=LOAD_BATCH_SIZE,
+    )
+    dtypes = {'dates': 'datetime64[s]', 'durations': np.int64, 'distances': np.float64, 'calories': np.int64}
+    chunks = {name: [np.empty(0, dtype=dtype)] for name, dtype in dtypes.items()}
+    while rows := list(itertools.islice(cursor, LOAD_BATCH_SIZE)):
+        chunks['dates'].append(np.array([row['date'] for row in rows], dtype='datetime64[s]'))
+        chunks['durations'].append(np.array([row['duration'] for row in rows], dtype=np.int64))
+        chunks['distances'].append(np.array([row.get('distance') or 0 for row in rows], dtype=np.float64))
+        chunks['calories'].append(np.array([row['calories'] for row in rows], dtype=np.int64))
+    return {name: np.concatenate(parts) for name, parts in chunks.items()}
+
+
+def compute(columns):
+    """
+    Everything in the stats response that depends only on the user's own activities
+    """
+    dates, durations = columns['dates'], columns['durations']
+    distances, calories = columns['distances'], columns['calories']
+    if not len(dates):
+        return {'activities': 0, 'totals': _totals(0, 0, 0.0), 'streaks': {'longest': 0, 'active_days': 0},
+                'weekly': [], 'personal_bests': {}, 'metrics': {'pace': None, 'calories_per_activity': None},
+                '_last_run': (0, None)}
+
+    days = np.unique(dates.astype('datetime64[D]'))
+    # A new run starts wherever consecutive active days are more than one day apart.
+    starts = np.flatnonzero(np.diff(days).astype(np.int64) != 1) + 1
+    run_lengths = np.diff(np.concatenate(([0], starts, [len(days)])))
+
+    paced = distances > 0
+    paces = np.where(paced, durations / np.where(paced, distances, 1), np.inf)
+    total_distance = float(distances.sum())
+    weekly, best_week = _weekly(dates, durations, distances, calories)
+    return {
+        'activities': len(dates),
+        'first_activity': _timestamp(dates[0]),
+        'last_activity': _timestamp(dates[-1]),
+        'totals': _totals(int(calories.sum()), int(durations.sum()), total_distance),
+        'streaks': {'longest': int(run_lengths.max()), 'active_days': len(days)},
+        'weekly': weekly,
+        'personal_bests': {**_personal_bests(dates, durations, distances, calories, paces), 'week': best_week},
+        'metrics': {
+            'pace': _pace(durations[paced].sum(), distances[paced].sum()),
+            'calories_per_activity': round(float(calories.mean()), 2),
+        },
+        '_last_run': (int(run_lengths[-1]), days[-1].astype(date)),
+    }
+
+
+def _totals(calories, duration, distance):
+    return {'calories': calories, 'duration': duration, 'distance': round(distance, 2)}
+
+
+def _weekly(dates, durations, distances, calories):
+    weeks = (dates.astype('datetime64[D]').astype(np.int64) + _WEEK_SHIFT) // 7
+    offsets = weeks - weeks[0]
+    span = int(offsets[-1]) + 1
+    series = {
+        'count': np.bincount(offsets, minlength=span),
+        'calories': np.bincount(offsets, weights=calories, minlength=span),
+        'duration': np.bincount(offsets, weights=durations, minlength=span),
+        'distance': np.bincount(offsets, weights=distances, minlength=span),
+    }
+    # Trailing mean over up to MOVING_AVERAGE_WEEKS weeks, weeks without activity counting as zero.
+    index = np.arange(span)
+    window_start = np.maximum(index + 1 - MOVING_AVERAGE_WEEKS, 0)
+    averages = {}
+    for name in ('calories', 'duration', 'distance'):
+        cumulative = np.concatenate(([0.0], np.cumsum(series[name])))
+        averages[name] = (cumulative[index + 1] - cumulative[window_start]) / (index + 1 - window_start)
+
+    result = []
+    for offset in range(max(0, span - WEEKS_RETURNED), span):
+        result.append({
+            'week': _week_label(weeks[0] + offset),
+            'count': int(series['count'][offset]),
+            'calories': int(series['calories'][offset]),
+            'duration': int(series['duration'][offset]),
+            'distance': round(float(series['distance'][offset]), 2),
+            'calories_avg': round(float(averages['calories'][offset]), 2),
+            'duration_avg': round(float(averages['duration'][offset]), 2),
+            'distance_avg': round(float(averages['distance'][offset]), 2),
+        })
+    best = int(np.argmax(series['calories']))
+    return result, {'calories': int(series['calories'][best]), 'week': _week_label(weeks[0] + best)}
+
+
+def _week_label(week):
+    # ISO label of the week numbered `week` (Monday-based weeks since the epoch).
+    year, number, _ = (date(1970, 1, 1) + timedelta(days=int(week) * 7 - _WEEK_SHIFT)).isocalendar()
+    return f'{year}-W{number:02d}'
+
+
+def _personal_bests(dates, durations, distances, calories, paces):
+    bests = {}
+    for name, values in (('calories', calories), ('duration', durations), ('distance', distances)):
+        row = int(np.argmax(values))
+        value = values[row].item()
+        bests[name] = {'value': round(value, 2) if name == 'distance' else value, 'date': _timestamp(dates[row])}
+    row = int(np.argmin(paces))
+    if np.isfinite(paces[row]):
+        bests['pace'] = {'value': round(float(paces[row]), 2), 'date': _timestamp(dates[row])}
+    return bests
+
+
+def _pace(duration, distance):
+    # Minutes per kilometre over the activities that recorded a distance.
+    return round(float(duration / distance), 2) if distance > 0 else None
+
+
+def _timestamp(value):
+    return f'{np.datetime_as_string(value, unit="s")}Z'
+
+
+def team_metrics(team):
+    """
+    (pace, calories_per_activity) arrays over the team's members, cached for a while
+    """
+    ttl = getattr(settings, 'OCTOFIT_USER_STATS_TEAM_TTL', 300)
+    with _lock:
+        cached = _teams.get(team)
+        if cached is not None and time.monotonic() < cached[0]:
+            _teams.move_to_end(team)
+            return cached[1]
+    db = get_db()
+    member_ids = [str(user['_id']) for user in db.users.find({'team': team}, {'_id': 1})]
+    pipeline = [
+        {'$match': {'user_id': {'$in': member_ids}}},
+        {'$group': {
+            '_id': '$user_id',
+            'count': {'$sum': 1},
+            'calories': {'$sum': '$calories'},
+            'paced_duration': {'$sum': {'$cond': [{'$gt': ['$distance', 0]}, '$duration', 0]}},
+            'distance': {'$sum': {'$cond': [{'$gt': ['$distance', 0]}, '$distance', 0]}},
+        }},
+    ]
+    groups = list(db.activities.aggregate(pipeline))
+    distance = np.array([group['distance'] for group in groups], dtype=np.float64)
+    paced_duration = np.array([group['paced_duration'] for group in groups], dtype=np.float64)
+    metrics = (
+        np.round(paced_duration[distance > 0] / distance[distance > 0], 2),
+        np.round(np.array([group['calories'] / group['count'] for group in groups], dtype=np.float64), 2),
+    )
+    with _lock:
+        _teams[team] = (time.monotonic() + ttl, metrics)
+        _teams.move_to_end(team)
+        while len(_teams) > getattr(settings, 'OCTOFIT_USER_STATS_TEAM_CACHE_SIZE', 256):
+            _teams.popitem(last=False)
+    return metrics
+
+
+def percentile_rank(values, value, higher_is_better=True):
+    """
+    Percent of `values` that `value` beats, counting ties as half
+    """
+    if value is None or not len(values):
+        return None
+    below = np.count_nonzero(values < value if higher_is_better else values > value)
+    ties = np.count_nonzero(values == value)
+    return round(100.0 * (below + 0.5 * ties) / len(values), 1)
+
+
+def user_stats(user_id, team):
+    """
+    The stats response for one user
+    """
+    latest = get_db().activities.find_one(
+        {'user_id': user_id}, {'date': 1, '_id': 0}, sort=[('date', -1), ('_id', -1)]
+    )
+    key = latest['date'] if latest else None
+    with _lock:
+        entry = _memo.get(user_id)
+        if entry is not None and entry[0] == key:
+            _memo.move_to_end(user_id)
+    if entry is None or entry[0] != key:
+        entry = (key, compute(load_columns(user_id)))
+        with _lock:
+            _memo[user_id] = entry
+            while len(_memo) > getattr(settings, 'OCTOFIT_USER_STATS_CACHE_SIZE', 1024):
+                _memo.popitem(last=False)
+
+    stats = {name: value for name, value in entry[1].items() if not name.startswith('_')}
+    run_length, run_end = entry[1]['_last_run']
+    current = run_length if run_end is not None and run_end >= timezone.now().date() - timedelta(days=1) else 0
+    stats['streaks'] = {**stats['streaks'], 'current': current}
+    stats['team'] = None
+    if team:
+        paces, calories = team_metrics(team)
+        stats['team'] = {
+            'name': team,
+            'pace_percentile': percentile_rank(paces, stats['metrics']['pace'], higher_is_better=False),
+            'calories_percentile': percentile_rank(calories, stats['metrics']['calories_per_activity']),
+        }
+    return {'user_id': user_id, **stats}
+
+
+def invalidate(user_ids=None):
+    """
+    Drop the memoized stats of the given users (all users if None)
+    """
+    with _lock:
+        if user_ids is None:
+            _memo.clear()
+            _teams.clear()
+        else:
+            for user_id in user_ids:
+                _memo.pop(user_id, None)
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # pymongo only reports to listeners registered before a client is
+        # created, and djongo opens its client on the first query.
+        from .metrics import register_command_listener
+        register_command_listener()
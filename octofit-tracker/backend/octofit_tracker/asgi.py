@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the app registry is ready.
+from octofit_tracker.leaderboard_stream import StreamRouter  # noqa: E402
+
+# /api/leaderboard/stream/ (SSE or WebSocket) is served in front of Django.
+application = StreamRouter(django_application)
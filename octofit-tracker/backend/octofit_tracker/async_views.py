@@ -0,0 +1,72 @@
+"""
+Async versions of the hottest read endpoints, for ASGI deployments.
+
+Under ASGI the DRF viewsets run in a worker thread per request and block it
+on pymongo for the whole request. The views here return the same responses as
+the activities list, leaderboard list and user retrieve endpoints while
+staying on the event loop: only the MongoDB round trip is handed to the
+shared executor in ``mongo.run_async``, and the documents are paginated and
+converted by the viewsets' own paginator and repositories. They are mounted
+under /api/async/ next to the sync routes. Responses are JSON or, for
+``Accept: application/msgpack``, MessagePack, like the sync API's.
+"""
+from django.http import HttpResponse
+from rest_framework.exceptions import NotAcceptable, NotFound, ValidationError
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+
+from .filters import compile_filters
+from .pagination import document_value
+from .renderers import MessagePackRenderer, ORJSONRenderer
+from .views import ActivityViewSet, LeaderboardViewSet, UserViewSet, requested_fields
+
+_renderers = [ORJSONRenderer(), MessagePackRenderer()]
+_negotiation = DefaultContentNegotiation()
+
+
+async def activity_list(request):
+    return await _keyset_list(request, ActivityViewSet)
+
+
+async def leaderboard_list(request):
+    return await _keyset_list(request, LeaderboardViewSet)
+
+
+async def user_detail(request, pk):
+    repository = UserViewSet.repository
+    request = Request(request)
+    try:
+        fields = requested_fields(request, UserViewSet.serializer_class)
+    except ValidationError as exc:
+        return _render(request, exc.detail, status=400)
+    document = await repository.async_get(pk, fields)
+    if document is None:
+        return _render(request, {'detail': 'Not found.'}, status=404)
+    return _render(request, repository.to_wire_list([document], fields)[0])
+
+
+async def _keyset_list(request, viewset):
+    paginator = viewset.pagination_class()
+    request = Request(request)
+    try:
+        fields = requested_fields(request, viewset.serializer_class)
+        query = compile_filters(viewset.query_filters, request.query_params, viewset.queryset.model)
+        query, sort, limit = paginator.repository_query(request, viewset, query)
+    except ValidationError as exc:
+        return _render(request, exc.detail, status=400)
+    except NotFound as exc:
+        return _render(request, {'detail': exc.detail}, status=404)
+    documents = await viewset.repository.async_find(query, sort=sort, limit=limit, fields=fields)
+    rows = paginator.trim(documents, document_value)
+    return _render(request, {
+        'next': paginator.get_next_link(),
+        'results': viewset.repository.to_wire_list(rows, fields),
+    })
+
+
+def _render(request, data, status=200):
+    try:
+        renderer, media_type = _negotiation.select_renderer(request, _renderers)
+    except NotAcceptable:
+        renderer, media_type = _renderers[0], _renderers[0].media_type
+    return HttpResponse(renderer.render(data, media_type), status=status, content_type=media_type)
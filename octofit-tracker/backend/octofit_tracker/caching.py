@@ -0,0 +1,132 @@
+"""
+Small in-process caches for expensive read results.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class CachedValue:
+    """
+    A computed value reused for `ttl` seconds or until invalidate() is called.
+
+    Concurrent callers that find the value stale wait for a single recompute
+    instead of each running it.
+    """
+
+    def __init__(self, compute, ttl):
+        self.compute = compute
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+        self._generation = 0
+
+    def get(self):
+        if time.monotonic() < self._expires_at:
+            return self._value
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return self._value
+            generation = self._generation
+            value = self.compute()
+            # Keep the result only if no write invalidated it while computing.
+            if generation == self._generation:
+                self._value = value
+                self._expires_at = time.monotonic() + self.ttl
+            return value
+
+    def invalidate(self):
+        self._generation += 1
+        self._expires_at = 0.0
+
+
+class ResponseCache:
+    """
+    Bounded LRU of serialized response data for read-mostly viewsets.
+
+    Entries are keyed by (collection, path, sorted query params) and tagged
+    with the collection's version; writes through the cached viewsets bump
+    the version, which orphans every entry built before it. Each entry also
+    expires after `ttl` seconds so writes made by other processes show up.
+    The ETag is a digest of the serialized data, so a client revalidating
+    with If-None-Match gets a 304 straight from memory.
+    """
+
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def version(self, collection):
+        """
+        (version number, last modified unix time) of a collection
+        """
+        with self._lock:
+            return self._versions.setdefault(collection, (0, time.time()))
+
+    def bump(self, collection):
+        with self._lock:
+            version, _ = self._versions.get(collection, (0, 0))
+            self._versions[collection] = (version + 1, time.time())
+
+    def get(self, collection, key):
+        version, _ = self.version(collection)
+        with self._lock:
+            entry = self._entries.get((collection, key))
+            if entry is None or entry['version'] != version or entry['expires_at'] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end((collection, key))
+            self.hits += 1
+            return entry
+
+    def put(self, collection, key, data, media_type=''):
+        version, last_modified = self.version(collection)
+        # Each representation of the same data gets its own ETag.
+        digest = hashlib.md5(media_type.encode())
+        digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+        entry = {
+            'version': version,
+            'data': data,
+            'etag': '"%s"' % digest.hexdigest(),
+            'last_modified': last_modified,
+            'expires_at': time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            self._entries[(collection, key)] = entry
+            self._entries.move_to_end((collection, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=getattr(settings, 'OCTOFIT_RESPONSE_CACHE_SIZE', 512),
+    ttl=getattr(settings, 'OCTOFIT_RESPONSE_CACHE_TTL', 60),
+)
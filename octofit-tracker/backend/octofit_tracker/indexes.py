@@ -0,0 +1,95 @@
+"""
+MongoDB index declarations for the octofit models.
+
+Models list their indexes in a ``mongo_indexes`` class attribute (djongo does
+not build indexes from Meta on its own). ``diff_indexes`` compares those
+declarations with what the server has, and ``ensure_indexes`` builds the
+missing ones; the ``sync_indexes`` management command wraps both.
+"""
+from django.apps import apps
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from .mongo import get_db
+
+__all__ = ['ASCENDING', 'DESCENDING', 'MongoIndex', 'declared_indexes', 'diff_indexes', 'ensure_indexes',
+           'index_usage']
+
+
+class MongoIndex:
+    """
+    One declared index: an ordered list of (field, direction) and options
+    """
+
+    def __init__(self, *keys, unique=False):
+        self.keys = [key if isinstance(key, tuple) else (key, ASCENDING) for key in keys]
+        self.unique = unique
+
+    @property
+    def name(self):
+        # Same naming scheme pymongo uses for unnamed indexes.
+        return '_'.join(f'{field}_{direction}' for field, direction in self.keys)
+
+    def signature(self):
+        return tuple(self.keys), self.unique
+
+    def as_index_model(self):
+        return IndexModel(self.keys, name=self.name, unique=self.unique)
+
+    def __repr__(self):
+        return f"MongoIndex({self.name}{', unique' if self.unique else ''})"
+
+
+def declared_indexes():
+    """
+    {collection name: [MongoIndex]} for every model that declares indexes
+    """
+    return {
+        model._meta.db_table: list(model.mongo_indexes)
+        for model in apps.get_app_config('octofit_tracker').get_models()
+        if getattr(model, 'mongo_indexes', None)
+    }
+
+
+def diff_indexes(db=None):
+    """
+    {collection: (missing MongoIndex list, undeclared live index names)}
+    """
+    db = db if db is not None else get_db()
+    result = {}
+    for collection, declared in declared_indexes().items():
+        live = db[collection].index_information()
+        live_signatures = {
+            (tuple((field, int(direction)) for field, direction in info['key']), bool(info.get('unique'))): name
+            for name, info in live.items()
+        }
+        missing = [index for index in declared if index.signature() not in live_signatures]
+        declared_signatures = {index.signature() for index in declared}
+        undeclared = [
+            name for signature, name in live_signatures.items()
+            if name != '_id_' and signature not in declared_signatures
+        ]
+        result[collection] = (missing, undeclared)
+    return result
+
+
+def ensure_indexes(db=None):
+    """
+    Build every declared index the server does not have yet; returns their names
+    """
+    db = db if db is not None else get_db()
+    created = []
+    for collection, (missing, _) in diff_indexes(db).items():
+        if missing:
+            created.extend(db[collection].create_indexes([index.as_index_model() for index in missing]))
+    return created
+
+
+def index_usage(collection, db=None):
+    """
+    {index name: (ops, since)} from $indexStats for one collection
+    """
+    db = db if db is not None else get_db()
+    return {
+        stats['name']: (stats['accesses']['ops'], stats['accesses']['since'])
+        for stats in db[collection].aggregate([{'$indexStats': {}}])
+    }
@@ -0,0 +1,247 @@
+"""
+Incremental maintenance of the leaderboard collection.
+
+Rows are ordered by total_calories (highest first), with ties broken by
+user_id so that every row has exactly one position; ``rank`` is that
+position counting from 1. Activity writes are folded into per-user deltas,
+applied with ``$inc`` and followed by a rank shift that only touches the rows
+whose totals lie between the user's old and new calories.
+"""
+import threading
+from collections import defaultdict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import DESCENDING
+
+from . import leaderboard_stream, rank_index
+from .caching import CachedValue
+from .mongo import get_db
+
+# Rank shifts read and rewrite neighbouring rows, so they must not interleave.
+_rank_lock = threading.Lock()
+
+
+def activity_deltas(added=(), removed=()):
+    """
+    Fold activity documents into {user_id: [calories, duration, distance]}
+    """
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            delta = deltas[str(activity['user_id'])]
+            delta[0] += sign * activity['calories']
+            delta[1] += sign * activity['duration']
+            delta[2] += sign * (activity.get('distance') or 0)
+    return dict(deltas)
+
+
+def apply_deltas(deltas):
+    """
+    Apply per-user total deltas and move the affected ranks.
+
+    Returns a list of (user_id, old_rank, new_rank) for every user whose row
+    was written; rows that were only shifted by one are not listed.
+    """
+    db = get_db()
+    now = timezone.now()
+    moves = []
+    changes = []
+    if len(leaderboard_stream.broadcaster):
+        # Loaded here, on the writing thread, so the stream's tick finds current ranks without a reload.
+        rank_index.warm()
+    with _rank_lock:
+        for user_id, (calories, duration, distance) in deltas.items():
+            if not (calories or duration or distance):
+                continue
+            before = db.leaderboard.find_one_and_update(
+                {'user_id': user_id},
+                {
+                    '$inc': {
+                        'total_calories': calories,
+                        'total_duration': duration,
+                        'total_distance': distance,
+                    },
+                    '$set': {'last_updated': now},
+                },
+                projection={'total_calories': 1, 'total_duration': 1, 'total_distance': 1, 'rank': 1, 'team': 1},
+            )
+            if before is None:
+                team = _user_team(db, user_id)
+                new_rank = _insert_row(db, user_id, team, calories, duration, distance, now)
+                rank_index.record(user_id, team, calories)
+                moves.append((user_id, None, new_rank))
+                totals = (calories, duration, distance)
+            else:
+                old_total = before['total_calories']
+                new_rank = before['rank']
+                if calories:
+                    new_rank = _shift_ranks(db, user_id, old_total, old_total + calories, before['rank'])
+                    rank_index.record(user_id, before.get('team', ''), old_total + calories)
+                moves.append((user_id, before['rank'], new_rank))
+                totals = (old_total + calories, before['total_duration'] + duration,
+                          before['total_distance'] + distance)
+            changes.append({
+                'user_id': user_id,
+                'old_rank': moves[-1][1],
+                'new_rank': new_rank,
+                'total_calories': totals[0],
+                'total_duration': totals[1],
+                'total_distance': totals[2],
+            })
+    if moves:
+        team_standings_cache.invalidate()
+        leaderboard_stream.broadcaster.publish(changes)
+    return moves
+
+
+def resync_users(user_ids, batch_size=1000):
+    """
+    Bring the rows of the given users in line with their activities.
+
+    Totals are re-aggregated from the activities collection and the
+    difference to the stored row is applied through ``apply_deltas``, so a
+    bulk load can settle the leaderboard once instead of once per activity.
+    """
+    db = get_db()
+    user_ids = sorted(set(user_ids))
+    deltas = {}
+    for start in range(0, len(user_ids), batch_size):
+        chunk = user_ids[start:start + batch_size]
+        totals = {user_id: [0, 0, 0.0] for user_id in chunk}
+        pipeline = [
+            {'$match': {'user_id': {'$in': chunk}}},
+            {'$group': {
+                '_id': '$user_id',
+                'calories': {'$sum': '$calories'},
+                'duration': {'$sum': '$duration'},
+                'distance': {'$sum': '$distance'},
+            }},
+        ]
+        for group in db.activities.aggregate(pipeline):
+            totals[group['_id']] = [group['calories'], group['duration'], group['distance']]
+        rows = db.leaderboard.find(
+            {'user_id': {'$in': chunk}},
+            {'user_id': 1, 'total_calories': 1, 'total_duration': 1, 'total_distance': 1},
+        )
+        for row in rows:
+            total = totals.pop(row['user_id'])
+            deltas[row['user_id']] = [
+                total[0] - row['total_calories'],
+                total[1] - row['total_duration'],
+                total[2] - row['total_distance'],
+            ]
+        # Users without a row yet, skipping those that still have no activity.
+        deltas.update((user_id, total) for user_id, total in totals.items() if any(total))
+    return apply_deltas(deltas)
+
+
+def read_rows(projection):
+    """
+    Every leaderboard row, read while no rank shift is in progress
+    """
+    with _rank_lock:
+        return list(get_db().leaderboard.find({}, projection))
+
+
+def _insert_row(db, user_id, team, calories, duration, distance, now):
+    # A new row enters below the current last place and climbs from there.
+    last = db.leaderboard.find_one({}, {'rank': 1}, sort=[('rank', DESCENDING)])
+    bottom_rank = (last['rank'] if last else 0) + 1
+    db.leaderboard.insert_one({
+        'user_id': user_id,
+        'team': team,
+        'total_calories': calories,
+        'total_duration': duration,
+        'total_distance': distance,
+        'rank': bottom_rank,
+        'last_updated': now,
+    })
+    result = db.leaderboard.update_many({
+        'user_id': {'$ne': user_id},
+        '$or': [
+            {'total_calories': {'$lt': calories}},
+            {'total_calories': calories, 'user_id': {'$gt': user_id}},
+        ],
+    }, {'$inc': {'rank': 1}})
+    new_rank = bottom_rank - result.modified_count
+    db.leaderboard.update_one({'user_id': user_id}, {'$set': {'rank': new_rank}})
+    return new_rank
+
+
+def _shift_ranks(db, user_id, old_total, new_total, old_rank):
+    if new_total > old_total:
+        # Rows overtaken: ahead of the old position, behind the new one.
+        result = db.leaderboard.update_many({
+            'user_id': {'$ne': user_id},
+            'total_calories': {'$gte': old_total, '$lte': new_total},
+            '$nor': [
+                {'total_calories': old_total, 'user_id': {'$gt': user_id}},
+                {'total_calories': new_total, 'user_id': {'$lt': user_id}},
+            ],
+        }, {'$inc': {'rank': 1}})
+        new_rank = old_rank - result.modified_count
+    else:
+        # Rows that overtook us: behind the old position, ahead of the new one.
+        result = db.leaderboard.update_many({
+            'user_id': {'$ne': user_id},
+            'total_calories': {'$gte': new_total, '$lte': old_total},
+            '$nor': [
+                {'total_calories': old_total, 'user_id': {'$lt': user_id}},
+                {'total_calories': new_total, 'user_id': {'$gt': user_id}},
+            ],
+        }, {'$inc': {'rank': -1}})
+        new_rank = old_rank + result.modified_count
+    if new_rank != old_rank:
+        db.leaderboard.update_one({'user_id': user_id}, {'$set': {'rank': new_rank}})
+    return new_rank
+
+
+def _user_team(db, user_id):
+    try:
+        user = db.users.find_one({'_id': ObjectId(user_id)}, {'team': 1})
+    except InvalidId:
+        user = None
+    return user['team'] if user else ''
+
+
+def sort_key(row):
+    """
+    Leaderboard order: highest calories first, then user_id
+    """
+    return (-row['total_calories'], str(row['user_id']))
+
+
+def team_standings():
+    """
+    Per-team totals aggregated server-side from the leaderboard, best team first
+    """
+    pipeline = [
+        {'$group': {
+            '_id': '$team',
+            'total_calories': {'$sum': '$total_calories'},
+            'total_duration': {'$sum': '$total_duration'},
+            'total_distance': {'$sum': '$total_distance'},
+            'members': {'$sum': 1},
+            'best_rank': {'$min': '$rank'},
+        }},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+    ]
+    standings = []
+    for rank, group in enumerate(get_db().leaderboard.aggregate(pipeline), start=1):
+        standings.append({
+            'rank': rank,
+            'team': group['_id'],
+            'total_calories': group['total_calories'],
+            'total_duration': group['total_duration'],
+            'total_distance': round(group['total_distance'], 2),
+            'members': group['members'],
+            'average_calories': round(group['total_calories'] / group['members'], 2),
+            'best_rank': group['best_rank'],
+        })
+    return standings
+
+
+team_standings_cache = CachedValue(team_standings, ttl=getattr(settings, 'OCTOFIT_TEAM_STANDINGS_TTL', 30))
@@ -0,0 +1,221 @@
+"""
+Leaderboard history kept as periodic snapshots.
+
+``take_snapshot`` records the board as it is now in ``leaderboard_snapshots``;
+the ``snapshot_leaderboard`` command runs it once or every --interval
+seconds. Every ``OCTOFIT_LEADERBOARD_KEYFRAME_INTERVAL``-th snapshot is a
+keyframe holding every row. The others hold only the rows whose team, rank or
+totals changed since the previous snapshot, as differences, plus the users
+that left the board. A snapshot in which nothing changed is not written, so
+storage grows with churn rather than with board size times snapshot count.
+
+A snapshot is split into documents of at most
+``OCTOFIT_LEADERBOARD_SNAPSHOT_CHUNK`` users. Each holds its user ids, the
+team names it mentions and one zlib-compressed int64 matrix with a row per
+user: the team (an index into the names), rank, total calories, duration
+and distance (in hundredths, so that deltas add up exactly).
+
+``board_at`` rebuilds the board at a timestamp from the last keyframe before
+it and the deltas after; ``rank_series`` follows one user through only the
+documents that mention them, found by the multikey index on ``user_ids``.
+"""
+import zlib
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING
+
+from . import leaderboard
+from .mongo import get_db
+
+COLUMNS = ('team', 'rank', 'total_calories', 'total_duration', 'total_distance')
+DISTANCE_SCALE = 100
+_EMPTY = ('', 0, 0, 0, 0)
+
+# (seq, board) of the latest snapshot this process wrote, so that taking the
+# next one does not replay history.
+_last = (None, None)
+
+
+def current_board():
+    """
+    {user_id: (team, rank, calories, duration, distance in hundredths)} of the live leaderboard
+    """
+    rows = leaderboard.read_rows({
+        '_id': 0, 'user_id': 1, 'team': 1, 'rank': 1, 'total_calories': 1, 'total_duration': 1, 'total_distance': 1,
+    })
+    return {
+        str(row['user_id']): (row.get('team') or '', row['rank'], row['total_calories'], row['total_duration'],
+                              round((row.get('total_distance') or 0) * DISTANCE_SCALE))
+        for row in rows
+    }
+
+
+def take_snapshot(now=None):
+    """
+    Record the live board; {'seq', 'keyframe', 'rows', 'removed'}, or None if nothing changed
+    """
+    global _last
+    db = get_db()
+    now = now or timezone.now()
+    board = current_board()
+    latest = db.leaderboard_snapshots.find_one({}, {'seq': 1, 'taken_at': 1}, sort=[('seq', DESCENDING)])
+    if latest is None:
+        seq, previous = 0, {}
+    else:
+        if now < _aware(latest['taken_at']):
+            raise ValueError('A snapshot cannot be older than the latest one.')
+        seq = latest['seq'] + 1
+        previous = _last[1] if _last[0] == latest['seq'] else _replay(db)[1]
+
+    removed = sorted(previous.keys() - board.keys())
+    changed = sorted(user_id for user_id, row in board.items() if previous.get(user_id) != row)
+    if not changed and not removed:
+        return None
+    keyframe = seq % getattr(settings, 'OCTOFIT_LEADERBOARD_KEYFRAME_INTERVAL', 24) == 0
+    user_ids = sorted(board) if keyframe else changed
+
+    chunk_size = getattr(settings, 'OCTOFIT_LEADERBOARD_SNAPSHOT_CHUNK', 1000)
+    documents = []
+    for start in range(0, max(len(user_ids), 1), chunk_size):
+        chunk_ids = user_ids[start:start + chunk_size]
+        teams = sorted({board[user_id][0] for user_id in chunk_ids})
+        team_index = {team: index for index, team in enumerate(teams)}
+        rows = []
+        for user_id in chunk_ids:
+            team, *totals = board[user_id]
+            if not keyframe:
+                totals = [value - before for value, before in zip(totals, previous.get(user_id, _EMPTY)[1:])]
+            rows.append([team_index[team], *totals])
+        values = np.array(rows, dtype='<i8').reshape(-1, len(COLUMNS))
+        documents.append({
+            'seq': seq,
+            'chunk': len(documents),
+            'taken_at': now,
+            'keyframe': keyframe,
+            'user_ids': chunk_ids,
+            'teams': teams,
+            'values': zlib.compress(values.tobytes()),
+            'removed': removed if not documents else [],
+        })
+    db.leaderboard_snapshots.insert_many(documents)
+    _last = (seq, board)
+    return {'seq': seq, 'keyframe': keyframe, 'rows': len(user_ids), 'removed': len(removed)}
+
+
+def invalidate():
+    """
+    Forget the board of the latest snapshot, e.g. after the collection was cleared
+    """
+    global _last
+    _last = (None, None)
+
+
+def board_at(at=None):
+    """
+    (taken_at, rows best first) of the latest snapshot taken at or before `at`, or None
+    """
+    taken_at, board = _replay(get_db(), at)
+    if taken_at is None:
+        return None
+    rows = [{'user_id': user_id, **_row(state)} for user_id, state in board.items()]
+    return taken_at, sorted(rows, key=lambda row: row['rank'])
+
+
+def rank_series(user_id, start=None, end=None):
+    """
+    The user's rank and totals at every snapshot taken between `start` and `end` while they were on the board
+    """
+    db = get_db()
+    first_seq = 0
+    if start is not None:
+        # The user's state at `start` is rebuilt from the last keyframe before it.
+        keyframe = db.leaderboard_snapshots.find_one(
+            {'keyframe': True, 'taken_at': {'$lte': start}}, {'seq': 1},
+            sort=[('taken_at', DESCENDING), ('seq', DESCENDING)],
+        )
+        first_seq = keyframe['seq'] if keyframe else 0
+    taken = {'$gte': start} if start is not None else {}
+    if end is not None:
+        taken['$lte'] = end
+
+    documents = db.leaderboard_snapshots.find(
+        {'seq': {'$gte': first_seq}, '$or': [{'user_ids': user_id}, {'removed': user_id}],
+         **({'taken_at': {'$lte': end}} if end is not None else {})},
+        sort=[('seq', ASCENDING)],
+    )
+    snapshots = db.leaderboard_snapshots.find(
+        {'chunk': 0, **({'taken_at': taken} if taken else {})}, {'seq': 1, 'taken_at': 1},
+        sort=[('taken_at', ASCENDING), ('seq', ASCENDING)],
+    )
+    series = []
+    state = None
+    pending = next(documents, None)
+    for snapshot in snapshots:
+        while pending is not None and pending['seq'] <= snapshot['seq']:
+            state = _user_state(pending, user_id, state)
+            pending = next(documents, None)
+        if state is not None:
+            series.append({'taken_at': _aware(snapshot['taken_at']), **_row(state)})
+    return series
+
+
+def _replay(db, at=None):
+    # (taken_at, board) after the latest snapshot at or before `at`; (None, {}) if there is none.
+    taken = {'taken_at': {'$lte': at}} if at is not None else {}
+    keyframe = db.leaderboard_snapshots.find_one(
+        {'keyframe': True, **taken}, {'seq': 1}, sort=[('taken_at', DESCENDING), ('seq', DESCENDING)]
+    )
+    if keyframe is None:
+        return None, {}
+    last = db.leaderboard_snapshots.find_one(taken, {'seq': 1}, sort=[('taken_at', DESCENDING), ('seq', DESCENDING)])
+    board = {}
+    taken_at = None
+    documents = db.leaderboard_snapshots.find(
+        {'seq': {'$gte': keyframe['seq'], '$lte': last['seq']}}, sort=[('seq', ASCENDING), ('chunk', ASCENDING)]
+    )
+    for document in documents:
+        if document['keyframe'] and document['chunk'] == 0:
+            board.clear()
+        for removed in document['removed']:
+            board.pop(removed, None)
+        for user_id, row in zip(document['user_ids'], _values(document).tolist()):
+            board[user_id] = _merge(board.get(user_id), row, document)
+        taken_at = document['taken_at']
+    return _aware(taken_at), board
+
+
+def _user_state(document, user_id, state):
+    if user_id in document['removed']:
+        return None
+    position = document['user_ids'].index(user_id)
+    return _merge(state, _values(document)[position].tolist(), document)
+
+
+def _values(document):
+    return np.frombuffer(zlib.decompress(document['values']), dtype='<i8').reshape(-1, len(COLUMNS))
+
+
+def _merge(state, row, document):
+    team = document['teams'][row[0]]
+    if document['keyframe'] or state is None:
+        return (team, *row[1:])
+    return (team, *(value + delta for value, delta in zip(state[1:], row[1:])))
+
+
+def _row(state):
+    team, rank, calories, duration, distance = state
+    return {
+        'team': team,
+        'rank': rank,
+        'total_calories': calories,
+        'total_duration': duration,
+        'total_distance': distance / DISTANCE_SCALE,
+    }
+
+
+def _aware(value):
+    # pymongo returns naive UTC datetimes.
+    return timezone.make_aware(value, dt_timezone.utc) if value is not None and timezone.is_naive(value) else value
@@ -0,0 +1,251 @@
+"""
+Push leaderboard changes to subscribers over Server-Sent Events or WebSocket.
+
+``leaderboard.apply_deltas`` publishes every row it writes as a change
+(user_id, old_rank, new_rank and the new totals). Changes are coalesced per
+user and fanned out once per tick (``OCTOFIT_STREAM_TICK`` seconds) as one
+message listing the changed users by their rank at that tick. Rows that only
+shifted by one place because someone passed them are not listed: the board is ordered
+by (-total_calories, user_id), so a client holding it re-sorts after
+applying the totals. Ranks come from the in-process rank index, which
+``apply_deltas`` loads and keeps current on the recompute worker while
+anyone is subscribed; the tick never loads it, and falls back to the rank
+published with the change if it is not loaded. Each subscriber keeps its own coalescing buffer rather
+than a queue, so a slow consumer receives fewer, larger messages instead of
+an unbounded backlog; once more than ``OCTOFIT_STREAM_MAX_PENDING`` users
+are pending it is sent ``{"reset": true}`` and should refetch the board.
+
+Django 4.1 cannot stream from an async iterator, so ``StreamRouter`` serves
+/api/leaderboard/stream/ at the ASGI level in front of the Django app.
+Only writes made in this process are seen.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from django.conf import settings
+
+from . import rank_index
+
+STREAM_PATH = '/api/leaderboard/stream/'
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    """
+    One connected client: changes waiting to be sent and a wake-up event
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.pending = {}
+        self.reset = False
+
+
+class Broadcaster:
+    """
+    Coalesces published changes and hands them to subscribers once per tick
+    """
+
+    def __init__(self, tick=1.0, max_pending=1000):
+        self.tick = tick
+        self.max_pending = max_pending
+        self.ticks = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._reset = False
+        self._subscribers = set()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, changes):
+        """
+        Queue change dicts (user_id, old_rank, new_rank, totals) for the next tick
+        """
+        if not self._subscribers:
+            return
+        with self._lock:
+            for change in changes:
+                _merge(self._pending, change)
+
+    def publish_reset(self):
+        """
+        Tell every subscriber to refetch the board (for writes that are not diffs)
+        """
+        if not self._subscribers:
+            return
+        with self._lock:
+            self._reset = True
+
+    def subscribe(self):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='octofit-leaderboard-stream', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    async def next_message(self, subscriber, timeout=None):
+        """
+        The next message for a subscriber, or None if `timeout` passes first
+        """
+        try:
+            await asyncio.wait_for(subscriber.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._lock:
+            subscriber.event.clear()
+            pending, reset = subscriber.pending, subscriber.reset
+            subscriber.pending, subscriber.reset = {}, False
+        if reset:
+            return {'reset': True}
+        return {'tick': self.ticks, 'changes': sorted(pending.values(), key=lambda change: change['new_rank'])}
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            if not self._flush():
+                return
+
+    def _flush(self):
+        # One tick; False once there is nobody left to deliver to.
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                self._pending, self._reset = {}, False
+                return False
+            pending, reset = self._pending, self._reset
+            self._pending, self._reset = {}, False
+        if not pending and not reset:
+            return True
+        # Later writes in the tick may have shifted earlier users; report ranks as of now.
+        ranks = rank_index.loaded_ranks(pending)
+        for change in pending.values():
+            change['new_rank'] = ranks.get(change['user_id']) or change['new_rank']
+        self._deliver(pending, reset)
+        return True
+
+    def _deliver(self, pending, reset):
+        with self._lock:
+            self.ticks += 1
+            for subscriber in list(self._subscribers):
+                if reset or len(subscriber.pending) + len(pending) > self.max_pending:
+                    subscriber.pending, subscriber.reset = {}, True
+                elif not subscriber.reset:
+                    for change in pending.values():
+                        _merge(subscriber.pending, change)
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.event.set)
+                except RuntimeError:
+                    # Its event loop is gone.
+                    self._subscribers.discard(subscriber)
+
+
+def _merge(pending, change):
+    # Several changes within one tick collapse into one: first old rank, last everything else.
+    earlier = pending.get(change['user_id'])
+    if earlier is not None:
+        change = {**change, 'old_rank': earlier['old_rank']}
+    pending[change['user_id']] = change
+
+
+broadcaster = Broadcaster(
+    tick=getattr(settings, 'OCTOFIT_STREAM_TICK', 1.0),
+    max_pending=getattr(settings, 'OCTOFIT_STREAM_MAX_PENDING', 1000),
+)
+
+
+class StreamRouter:
+    """
+    ASGI app serving the leaderboard stream and passing everything else on
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ('http', 'websocket') and scope['path'] == STREAM_PATH:
+            if scope['type'] == 'websocket':
+                return await serve_websocket(scope, receive, send)
+            return await serve_events(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+
+async def serve_events(scope, receive, send):
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'access-control-allow-origin', b'*'),
+            # Keeps nginx and similar proxies from buffering the stream.
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+    async def stream():
+        while True:
+            message = await broadcaster.next_message(subscriber, timeout=HEARTBEAT_SECONDS)
+            if message is None:
+                body = b': heartbeat\n\n'
+            else:
+                event = 'reset' if message.get('reset') else 'ranks'
+                body = f'event: {event}\ndata: {json.dumps(message, separators=(",", ":"))}\n\n'.encode()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    subscriber = broadcaster.subscribe()
+    try:
+        await _until_disconnect(stream(), receive, 'http.disconnect')
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def serve_websocket(scope, receive, send):
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def stream():
+        while True:
+            message = await broadcaster.next_message(subscriber)
+            await send({'type': 'websocket.send', 'text': json.dumps(message, separators=(',', ':'))})
+
+    subscriber = broadcaster.subscribe()
+    try:
+        await _until_disconnect(stream(), receive, 'websocket.disconnect')
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def _until_disconnect(stream, receive, disconnect_type):
+    """
+    Run `stream` until the client disconnects (or sending to it fails)
+    """
+    async def disconnected():
+        while (await receive())['type'] != disconnect_type:
+            pass
+
+    tasks = [asyncio.ensure_future(stream), asyncio.ensure_future(disconnected())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), OSError):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,272 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+import csv
+import hashlib
+import json
+import os
+import time
+
+from octofit_tracker import leaderboard, rollups
+from octofit_tracker.models import Activity
+from octofit_tracker.mongo import get_db
+
+DUPLICATE_KEY_ERROR = 11000
+MAX_REPORTED_ERRORS = 20
+READ_BUFFER_SIZE = 1 << 20
+
+
+class Command(BaseCommand):
+    help = 'Import activities from a CSV or NDJSON file exported by another tracker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or NDJSON file of activities')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default=None,
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows validated and inserted per batch')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Checkpoint file recording progress (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true', help='Continue from the byte offset in the checkpoint')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.verbosity = options['verbosity']
+        path = os.path.abspath(options['path'])
+        if not os.path.isfile(path):
+            raise CommandError(f'{path}: no such file')
+        input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        # The users whose activities were imported so far, one id per line,
+        # appended as batches are checkpointed.
+        users_path = f'{checkpoint_path}.users'
+        batch_size = options['batch_size']
+
+        state = {'source': path, 'offset': 0, 'rows': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0}
+        user_ids = set()
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                state = json.load(checkpoint)
+            if state['source'] != path:
+                raise CommandError(f"{checkpoint_path} belongs to {state['source']}")
+            if os.path.exists(users_path):
+                with open(users_path) as users:
+                    user_ids = {line.strip() for line in users if line.strip()}
+            self.stdout.write(f"Resuming at byte {state['offset']} after {state['rows']} rows")
+        resumed = state['offset'] > 0
+
+        db = get_db()
+        # One query up front; every row's email is then resolved from memory.
+        emails, teams = {}, {}
+        for user in db.users.find({}, {'email': 1, 'team': 1}):
+            emails[user['email'].lower()] = str(user['_id'])
+            teams[str(user['_id'])] = user.get('team', '')
+        columns = [
+            (field.name, field) for field in Activity._meta.concrete_fields
+            if not field.primary_key and field.name != 'user_id'
+        ]
+
+        rollup_deltas = defaultdict(lambda: [0, 0, 0.0, 0])
+        with open(path, 'rb', buffering=READ_BUFFER_SIZE) as stream, \
+                open(users_path, 'a' if resumed else 'w') as users:
+            batch = []
+            for record in self.records(stream, input_format, state['offset']):
+                batch.append(record)
+                if len(batch) == batch_size:
+                    touched = self.import_batch(db, batch, columns, emails, teams, state, rollup_deltas)
+                    self.save_checkpoint(checkpoint_path, state, users, touched - user_ids)
+                    user_ids |= touched
+                    batch = []
+            if batch:
+                touched = self.import_batch(db, batch, columns, emails, teams, state, rollup_deltas)
+                self.save_checkpoint(checkpoint_path, state, users, touched - user_ids)
+                user_ids |= touched
+
+        # Derived collections are settled once for the whole import.
+        self.stdout.write(f'Updating leaderboard for {len(user_ids)} users...')
+        leaderboard.resync_users(user_ids)
+        if resumed or state['duplicates']:
+            # Rows inserted by an earlier run are not in this run's deltas.
+            self.stdout.write('Rebuilding activity rollups...')
+            rollups.rebuild(db)
+        else:
+            self.stdout.write('Updating activity rollups...')
+            rollups.apply_deltas(rollup_deltas, db)
+        for finished in (checkpoint_path, users_path):
+            if os.path.exists(finished):
+                os.remove(finished)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {state['inserted']} activities from {state['rows']} rows "
+            f"({state['duplicates']} already present, {state['rejected']} rejected) "
+            f"in {elapsed:.1f}s ({state['rows'] / elapsed:,.0f} rows/s)"
+        ))
+
+    def records(self, stream, input_format, offset):
+        """
+        Yield (start offset, end offset, raw bytes, row dict, parse error) from the given offset on
+        """
+        if input_format == 'ndjson':
+            stream.seek(offset)
+            for line in stream:
+                start, offset = offset, offset + len(line)
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield start, offset, line, {}, {'non_field_errors': [f'Invalid JSON: {exc}']}
+                    continue
+                if isinstance(row, dict):
+                    yield start, offset, line, row, None
+                else:
+                    yield start, offset, line, {}, {'non_field_errors': ['Expected a JSON object.']}
+            return
+
+        header = stream.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]), [])
+        offset = max(offset, len(header))
+        stream.seek(offset)
+        # csv.reader pulls as many lines as a record needs (quoted fields may
+        # contain newlines); the lines it consumed give the record's bytes.
+        consumed = []
+
+        def lines():
+            for line in stream:
+                consumed.append(line)
+                yield line.decode('utf-8')
+
+        try:
+            for values in csv.reader(lines()):
+                raw = b''.join(consumed)
+                consumed.clear()
+                start, offset = offset, offset + len(raw)
+                if not values:
+                    continue
+                if len(values) != len(fieldnames):
+                    yield start, offset, raw, {}, {
+                        'non_field_errors': [f'Expected {len(fieldnames)} columns, got {len(values)}.']
+                    }
+                    continue
+                yield start, offset, raw, dict(zip(fieldnames, values)), None
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise CommandError(f'Unreadable CSV after byte {offset}: {exc}')
+
+    def import_batch(self, db, batch, columns, emails, teams, state, rollup_deltas):
+        """
+        Validate and insert one batch; returns the ids of the users whose activities it imported
+        """
+        documents, errors = self.validate([record[3:] for record in batch], columns, emails, teams)
+
+        pending = []
+        for (start, _, raw, _, _), document, error in zip(batch, documents, errors):
+            state['rows'] += 1
+            if error:
+                self.reject(state, start, error)
+                continue
+            # Ids derived from the row's position and bytes make re-imports
+            # (or a crash between insert and checkpoint) hit duplicate keys
+            # instead of duplicating activities.
+            document['_id'] = ObjectId(hashlib.blake2b(b'%d:' % start + raw, digest_size=12).digest())
+            pending.append((start, document))
+
+        failed = {}
+        if pending:
+            try:
+                db.activities.insert_many([document for _, document in pending], ordered=False)
+            except BulkWriteError as exc:
+                failed = {error['index']: error for error in exc.details['writeErrors']}
+
+        user_ids = set()
+        inserted = []
+        for index, (start, document) in enumerate(pending):
+            if index not in failed:
+                inserted.append(document)
+            elif failed[index]['code'] == DUPLICATE_KEY_ERROR:
+                state['duplicates'] += 1
+                user_ids.add(document['user_id'])
+            else:
+                self.reject(state, start, {'non_field_errors': [failed[index]['errmsg']]})
+        state['inserted'] += len(inserted)
+        state['offset'] = batch[-1][1]
+        user_ids.update(document['user_id'] for document in inserted)
+        for key, values in rollups.activity_deltas(inserted, teams=teams).items():
+            total = rollup_deltas[key]
+            for position, value in enumerate(values):
+                total[position] += value
+
+        if self.verbosity >= 2:
+            self.stdout.write(f"{state['rows']} rows read, {state['inserted']} activities imported")
+        return user_ids
+
+    def validate(self, rows, columns, emails, teams):
+        """
+        Check a chunk of (row, parse error) pairs against the Activity fields, one column at a time.
+
+        Returns parallel lists of documents and {field: [messages]} errors
+        (empty for valid rows).
+        """
+        documents = [{} for _ in rows]
+        errors = [dict(error or {}) for _, error in rows]
+        rows = [row for row, _ in rows]
+
+        for row, document, error in zip(rows, documents, errors):
+            if error:
+                continue
+            user_id = row.get('user_id') or emails.get(str(row.get('email') or '').strip().lower())
+            if user_id is None:
+                error['email'] = ['No user with this email.']
+            elif str(user_id) not in teams:
+                error['user_id'] = ['Unknown user.']
+            else:
+                document['user_id'] = str(user_id)
+
+        for name, field in columns:
+            default = field.get_default() if field.has_default() else ('' if field.blank else None)
+            for row, document, error in zip(rows, documents, errors):
+                if 'non_field_errors' in error:
+                    continue
+                value = row.get(name)
+                if value is None or value == '':
+                    if default is None:
+                        error[name] = ['This field is required.']
+                    else:
+                        document[name] = default
+                    continue
+                try:
+                    value = field.to_python(value)
+                    field.run_validators(value)
+                except ValidationError as exc:
+                    error[name] = exc.messages
+                    continue
+                except (TypeError, ValueError):
+                    # e.g. a number in an NDJSON date, which DateTimeField cannot parse.
+                    message = field.error_messages.get('invalid', 'Enter a valid value.')
+                    error[name] = ValidationError(message, code='invalid', params={'value': value}).messages
+                    continue
+                if isinstance(value, datetime) and timezone.is_naive(value):
+                    value = timezone.make_aware(value, dt_timezone.utc)
+                document[name] = value
+        return documents, errors
+
+    def reject(self, state, start, error):
+        state['rejected'] += 1
+        if state['rejected'] <= MAX_REPORTED_ERRORS:
+            self.stderr.write(f'Rejected row at byte {start}: {json.dumps(error)}')
+        elif state['rejected'] == MAX_REPORTED_ERRORS + 1:
+            self.stderr.write('Further rejected rows are counted but not shown')
+
+    def save_checkpoint(self, checkpoint_path, state, users, new_user_ids):
+        # Only the batch's new users are appended, so a checkpoint costs
+        # the same at the end of a large import as at its start.
+        users.writelines(f'{user_id}\n' for user_id in sorted(new_user_ids))
+        users.flush()
+        # Write-then-rename so an interrupted run never leaves a torn checkpoint.
+        temporary = f'{checkpoint_path}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary, checkpoint_path)
@@ -1,16 +1,48 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timedelta
+from bson import ObjectId
 from pymongo import MongoClient
-from datetime import datetime, timedelta
+import os
 import random
+import time
+
+from octofit_tracker import rollups
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.leaderboard import sort_key
+from octofit_tracker.mongo import client_options, get_db
+
+ACTIVITY_TYPES = ["running", "cycling", "swimming", "gym", "yoga", "walking"]
+DISTANCE_TYPES = ["running", "cycling", "walking"]
+# Team.members is a single document; keep it well under MongoDB's 16MB limit.
+MAX_TEAM_MEMBERS_STORED = 10000
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=None,
+                            help='Generate this many synthetic users instead of the 10 sample heroes')
+        parser.add_argument('--teams', type=int, default=2, help='Number of synthetic teams')
+        parser.add_argument('--activities-per-user', type=int, default=8,
+                            help='Average activities per synthetic user')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes generating synthetic data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per insert_many')
+        parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                            help='Latest synthetic activity date, YYYY-MM-DD (default today)')
+
     def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
         # Connect to MongoDB
-        client = MongoClient('mongodb://localhost:27017/')
-        db = client['octofit_db']
+        db = get_db()
 
         # Delete existing data
         self.stdout.write('Deleting existing data...')
@@ -19,11 +51,34 @@ class Command(BaseCommand):
         db.activities.delete_many({})
         db.leaderboard.delete_many({})
         db.workouts.delete_many({})
+        db.activity_rollups.delete_many({})
+
+        if options['users'] is not None:
+            counts = self.populate_synthetic(db, options)
+        else:
+            counts = self.populate_heroes(db)
 
-        # Create unique index on email
-        self.stdout.write('Creating unique index on email...')
-        db.users.create_index([("email", 1)], unique=True)
+        # Build the indexes declared on the models (including unique email);
+        # doing it after the bulk load is cheaper than maintaining them per insert.
+        self.stdout.write('Creating indexes...')
+        ensure_indexes(db)
+
+        counts['workout suggestions'] = self.insert_workouts(db)
+
+        # Build per-user and per-team daily/weekly rollups
+        self.stdout.write('Building activity rollups...')
+        counts['activity rollup buckets'] = rollups.rebuild(db)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Successfully populated database with:'))
+        for label, count in counts.items():
+            self.stdout.write(self.style.SUCCESS(f'  - {count} {label}'))
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} documents in {elapsed:.1f}s ({total / elapsed:,.0f} documents/s)'
+        ))
 
+    def populate_heroes(self, db):
         # Sample superhero data - Team Marvel
         marvel_heroes = [
             {
@@ -104,7 +159,8 @@ class Command(BaseCommand):
 
         # Insert users
         self.stdout.write('Inserting users...')
-        users_result = db.users.insert_many(marvel_heroes + dc_heroes)
+        heroes = marvel_heroes + dc_heroes
+        users_result = db.users.insert_many(heroes)
         user_ids = users_result.inserted_ids
 
         # Create teams
@@ -128,17 +184,17 @@ class Command(BaseCommand):
         # Create activities
         self.stdout.write('Inserting activities...')
         activities = []
-        activity_types = ["running", "cycling", "swimming", "gym", "yoga", "walking"]
+        activity_types = ACTIVITY_TYPES
         
         for i, user_id in enumerate(user_ids):
             # Each user has 5-10 activities
             for _ in range(random.randint(5, 10)):
                 activity_type = random.choice(activity_types)
                 activities.append({
-                    "user_id": user_id,
+                    "user_id": str(user_id),
                     "type": activity_type,
                     "duration": random.randint(15, 120),  # minutes
-                    "distance": round(random.uniform(1.0, 20.0), 2) if activity_type in ["running", "cycling", "walking"] else 0,
+                    "distance": round(random.uniform(1.0, 20.0), 2) if activity_type in DISTANCE_TYPES else 0,
                     "calories": random.randint(100, 800),
                     "date": datetime.now() - timedelta(days=random.randint(0, 30)),
                     "notes": f"Great {activity_type} session!"
@@ -150,15 +206,19 @@ class Command(BaseCommand):
         self.stdout.write('Inserting leaderboard entries...')
         leaderboard = []
         
+        # Total every user's activities in a single grouped pass
+        totals = defaultdict(lambda: [0, 0, 0])
+        for activity in activities:
+            user_totals = totals[activity['user_id']]
+            user_totals[0] += activity['calories']
+            user_totals[1] += activity['duration']
+            user_totals[2] += activity['distance']
+
         for i, user_id in enumerate(user_ids):
-            user_activities = [a for a in activities if a['user_id'] == user_id]
-            total_calories = sum(a['calories'] for a in user_activities)
-            total_duration = sum(a['duration'] for a in user_activities)
-            total_distance = sum(a['distance'] for a in user_activities)
-            
+            total_calories, total_duration, total_distance = totals[str(user_id)]
             leaderboard.append({
-                "user_id": user_id,
-                "team": "Team Marvel" if i < 5 else "Team DC",
+                "user_id": str(user_id),
+                "team": heroes[i]["team"],
                 "total_calories": total_calories,
                 "total_duration": total_duration,
                 "total_distance": round(total_distance, 2),
@@ -166,13 +226,89 @@ class Command(BaseCommand):
                 "last_updated": datetime.now()
             })
         
-        # Sort by total calories and assign ranks
-        leaderboard.sort(key=lambda x: x['total_calories'], reverse=True)
+        # Sort by total calories (ties by user_id, as incremental updates do) and assign ranks
+        leaderboard.sort(key=sort_key)
         for idx, entry in enumerate(leaderboard):
             entry['rank'] = idx + 1
         
         db.leaderboard.insert_many(leaderboard)
 
+        return {
+            'users': len(user_ids),
+            'teams': len(teams),
+            'activities': len(activities),
+            'leaderboard entries': len(leaderboard),
+        }
+
+    def populate_synthetic(self, db, options):
+        user_count, team_count = options['users'], options['teams']
+        workers, batch_size = max(1, options['workers']), max(1, options['batch_size'])
+        if user_count < 1 or team_count < 1 or options['activities_per_user'] < 0:
+            raise CommandError('--users and --teams must be positive and --activities-per-user not negative')
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        end = datetime.combine(options['end_date'] or date.today(), dt_time(23, 59))
+        team_names = [f'Team {i + 1}' for i in range(team_count)]
+
+        # Several chunks per worker keeps the pool busy when chunk costs differ.
+        chunk_size = max(1, min(50000, -(-user_count // (workers * 4))))
+        tasks = [
+            (connection.settings_dict['NAME'], client_options(), seed, start, min(start + chunk_size, user_count),
+             team_names, options['activities_per_user'], end, batch_size)
+            for start in range(0, user_count, chunk_size)
+        ]
+        self.stdout.write(f'Generating {user_count} users in {len(tasks)} chunks '
+                          f'on {workers} workers (seed {seed})...')
+
+        activity_count, rows = 0, []
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for chunk_activities, chunk_rows in pool.map(generate_chunk, tasks):
+                    activity_count += chunk_activities
+                    rows.extend(chunk_rows)
+        else:
+            for chunk_activities, chunk_rows in map(generate_chunk, tasks):
+                activity_count += chunk_activities
+                rows.extend(chunk_rows)
+
+        self.stdout.write('Inserting teams...')
+        now = datetime.now()
+        db.teams.insert_many([
+            {
+                "name": name,
+                "description": f"Synthetic team {i + 1}",
+                "members": [synthetic_user_id(seed, index)
+                            for index in range(i, min(user_count, i + MAX_TEAM_MEMBERS_STORED * team_count), team_count)],
+                "created_at": now
+            }
+            for i, name in enumerate(team_names)
+        ])
+
+        # Per-user totals were grouped by the workers; only sorting is left.
+        self.stdout.write('Inserting leaderboard entries...')
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        for start in range(0, len(rows), batch_size):
+            db.leaderboard.insert_many([
+                {
+                    "user_id": user_id,
+                    "team": team,
+                    "total_calories": total_calories,
+                    "total_duration": total_duration,
+                    "total_distance": total_distance,
+                    "rank": rank,
+                    "last_updated": now
+                }
+                for rank, (user_id, team, total_calories, total_duration, total_distance)
+                in enumerate(rows[start:start + batch_size], start=start + 1)
+            ], ordered=False)
+
+        return {
+            'users': user_count,
+            'teams': team_count,
+            'activities': activity_count,
+            'leaderboard entries': len(rows),
+        }
+
+    def insert_workouts(self, db):
         # Create workout suggestions
         self.stdout.write('Inserting workout suggestions...')
         workouts = [
@@ -219,10 +355,72 @@ class Command(BaseCommand):
         ]
         
         db.workouts.insert_many(workouts)
+        return len(workouts)
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully populated database with:'))
-        self.stdout.write(self.style.SUCCESS(f'  - {len(user_ids)} users'))
-        self.stdout.write(self.style.SUCCESS(f'  - {len(teams)} teams'))
-        self.stdout.write(self.style.SUCCESS(f'  - {len(activities)} activities'))
-        self.stdout.write(self.style.SUCCESS(f'  - {len(leaderboard)} leaderboard entries'))
-        self.stdout.write(self.style.SUCCESS(f'  - {len(workouts)} workout suggestions'))
+
+def synthetic_user_id(seed, index):
+    """
+    Deterministic ObjectId for the index-th synthetic user of a seed
+    """
+    return ObjectId(f'{seed & 0xffffffff:08x}{index:016x}')
+
+
+def generate_chunk(task):
+    """
+    Generate and insert users [start, stop) and their activities.
+
+    Runs in a worker process with its own MongoClient. Returns the number of
+    activities inserted and one (user_id, team, calories, duration, distance)
+    total per user, accumulated while generating.
+    """
+    db_name, client_kwargs, seed, start, stop, team_names, per_user, end, batch_size = task
+    rng = random.Random(f'{seed}:{start}')
+    client = MongoClient(**client_kwargs)
+    db = client[db_name]
+    users, activities, rows = [], [], []
+    activity_count = 0
+    try:
+        for index in range(start, stop):
+            user_id = synthetic_user_id(seed, index)
+            team = team_names[index % len(team_names)]
+            users.append({
+                "_id": user_id,
+                "name": f"User {index}",
+                "email": f"user{index}@octofit.test",
+                "password": "hashed_password",
+                "team": team,
+                "created_at": end
+            })
+            calories = duration = 0
+            distance = 0.0
+            for _ in range(rng.randint(per_user // 2, per_user + per_user // 2)):
+                activity_type = rng.choice(ACTIVITY_TYPES)
+                activity = {
+                    "user_id": str(user_id),
+                    "type": activity_type,
+                    "duration": rng.randint(15, 120),
+                    "distance": round(rng.uniform(1.0, 20.0), 2) if activity_type in DISTANCE_TYPES else 0,
+                    "calories": rng.randint(100, 800),
+                    "date": end - timedelta(minutes=rng.randrange(30 * 24 * 60)),
+                    "notes": f"Great {activity_type} session!"
+                }
+                activities.append(activity)
+                calories += activity['calories']
+                duration += activity['duration']
+                distance += activity['distance']
+                if len(activities) >= batch_size:
+                    db.activities.insert_many(activities, ordered=False)
+                    activity_count += len(activities)
+                    activities = []
+            rows.append((str(user_id), team, calories, duration, round(distance, 2)))
+            if len(users) >= batch_size:
+                db.users.insert_many(users, ordered=False)
+                users = []
+        if users:
+            db.users.insert_many(users, ordered=False)
+        if activities:
+            db.activities.insert_many(activities, ordered=False)
+            activity_count += len(activities)
+    finally:
+        client.close()
+    return activity_count, rows
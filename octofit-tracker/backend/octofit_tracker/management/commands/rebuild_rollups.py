@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the activity_rollups collection from all activities'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding activity rollups...')
+        count = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollup buckets'))
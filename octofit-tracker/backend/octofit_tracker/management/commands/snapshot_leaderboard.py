@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import leaderboard_history
+
+
+class Command(BaseCommand):
+    help = 'Record a leaderboard history snapshot, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running and take a snapshot every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            result = leaderboard_history.take_snapshot()
+            if result is None:
+                self.stdout.write('Leaderboard unchanged, no snapshot written')
+            else:
+                kind = 'keyframe' if result['keyframe'] else 'delta'
+                self.stdout.write(self.style.SUCCESS(
+                    f"Snapshot {result['seq']} ({kind}): {result['rows']} rows, {result['removed']} removed"
+                ))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
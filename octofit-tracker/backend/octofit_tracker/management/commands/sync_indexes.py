@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.indexes import diff_indexes, ensure_indexes, index_usage
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Build the MongoDB indexes declared on the octofit models and report unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report, do not build missing indexes')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        diff = diff_indexes(db)
+
+        for collection, (missing, undeclared) in sorted(diff.items()):
+            self.stdout.write(f'{collection}:')
+            for index in missing:
+                self.stdout.write(self.style.WARNING(f'  missing     {index.name}'))
+            for name in undeclared:
+                self.stdout.write(f'  undeclared  {name}')
+
+            # $indexStats counts accesses since the server (or index) started.
+            for name, (ops, since) in sorted(index_usage(collection, db).items()):
+                if ops == 0 and name != '_id_':
+                    self.stdout.write(self.style.NOTICE(f'  unused      {name} (no accesses since {since:%Y-%m-%d %H:%M})'))
+
+        if options['dry_run']:
+            return
+        created = ensure_indexes(db)
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f'Built index {name}'))
+        if not created:
+            self.stdout.write(self.style.SUCCESS('All declared indexes exist'))
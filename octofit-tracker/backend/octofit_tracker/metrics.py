@@ -0,0 +1,317 @@
+"""
+Request, MongoDB and serialization metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every request and attributes the time spent in
+MongoDB commands (reported by ``CommandListener`` through pymongo's command
+monitoring), in serialization (reported by the serializer and repository
+code through ``record_phase``) and in response rendering to the resolved
+view; whatever is left is view logic and djongo's SQL translation. Samples
+land in fixed-bucket histograms held in this process and are exposed by the
+``metrics`` view. When ``OCTOFIT_SLOW_REQUEST_SECONDS`` is set, requests
+slower than that are logged with the MongoDB commands they issued.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, as in the Prometheus client libraries' defaults.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('mongo', 'serialize', 'render', 'other')
+# Bulk payloads are summarized by size in the slow-request log.
+BULK_COMMAND_KEYS = ('documents', 'updates', 'deletes')
+MAX_LOGGED_COMMAND_LENGTH = 500
+
+_current = contextvars.ContextVar('octofit_request_sample', default=None)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram, one series per label tuple
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{{{base + "," if base else ""}{le}}} {cumulative}')
+            lines.append(f'{self.name}_sum{_braced(base)} {total}')
+            lines.append(f'{self.name}_count{_braced(base)} {cumulative}')
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter, one series per label tuple
+    """
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, value in series:
+            lines.append(f'{self.name}{_braced(_format_labels(self.label_names, labels))} {value}')
+        return lines
+
+
+class Gauge:
+    """
+    Unlabelled value read from `function` at exposition time
+    """
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+
+    def expose(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {self.function()}']
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _braced(labels):
+    return f'{{{labels}}}' if labels else ''
+
+
+request_duration = Histogram(
+    'octofit_http_request_duration_seconds', 'Time to produce a response, by view.', ('view', 'method', 'status'))
+request_phase = Histogram(
+    'octofit_http_request_phase_seconds', 'Time per request spent in each phase, by view.', ('view', 'phase'))
+request_mongo_commands = Counter(
+    'octofit_http_request_mongo_commands_total', 'MongoDB commands issued while handling requests.', ('view',))
+slow_requests = Counter(
+    'octofit_http_slow_requests_total', 'Requests slower than OCTOFIT_SLOW_REQUEST_SECONDS.', ('view',))
+mongo_command_duration = Histogram(
+    'octofit_mongo_command_duration_seconds', 'MongoDB command round trips, by command.', ('command',))
+mongo_command_failures = Counter(
+    'octofit_mongo_command_failures_total', 'MongoDB commands that failed, by command.', ('command',))
+
+REGISTRY = [request_duration, request_phase, request_mongo_commands, slow_requests, mongo_command_duration,
+            mongo_command_failures]
+
+
+def register(*metrics):
+    """
+    Add metrics defined elsewhere to the exposition
+    """
+    REGISTRY.extend(metrics)
+
+
+class RequestSample:
+    """
+    Time and MongoDB commands accumulated while one request is handled
+    """
+    __slots__ = ('phases', 'commands', 'command_log')
+
+    def __init__(self, log_commands=False):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.commands = 0
+        self.command_log = [] if log_commands else None
+
+
+def record_phase(phase, seconds):
+    """
+    Attribute `seconds` to a phase of the current request, if any
+    """
+    sample = _current.get()
+    if sample is not None:
+        sample.phases[phase] += seconds
+
+
+class CommandListener(monitoring.CommandListener):
+    """
+    Feeds pymongo command events into the histograms and the current request
+    """
+
+    def started(self, event):
+        sample = _current.get()
+        if sample is not None and sample.command_log is not None:
+            sample.command_log.append([event.command_name, event.command, None])
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        mongo_command_failures.inc((event.command_name,))
+        self._finished(event)
+
+    def _finished(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe((event.command_name,), seconds)
+        sample = _current.get()
+        if sample is not None:
+            sample.phases['mongo'] += seconds
+            sample.commands += 1
+            if sample.command_log:
+                sample.command_log[-1][2] = seconds
+
+
+_listener_lock = threading.Lock()
+_listener_registered = False
+
+
+def register_command_listener():
+    """
+    Register the command listener with pymongo; clients created afterwards report to it
+    """
+    global _listener_registered
+    with _listener_lock:
+        if not _listener_registered:
+            monitoring.register(CommandListener())
+            _listener_registered = True
+
+
+class MetricsMiddleware:
+    """
+    Time each request and attribute it to phases of the resolved view
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'OCTOFIT_SLOW_REQUEST_SECONDS', None)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Marks the instance as a coroutine function so Django awaits it
+            # directly under ASGI, as MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        sample = RequestSample(log_commands=self.slow_seconds is not None)
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+        self.observe(request, response, elapsed, sample)
+        return response
+
+    async def __acall__(self, request):
+        sample = RequestSample(log_commands=self.slow_seconds is not None)
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+        self.observe(request, response, elapsed, sample)
+        return response
+
+    def observe(self, request, response, elapsed, sample):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        request_duration.observe((view, request.method, response.status_code), elapsed)
+        measured = 0.0
+        for phase, seconds in sample.phases.items():
+            measured += seconds
+            if phase != 'other':
+                request_phase.observe((view, phase), seconds)
+        request_phase.observe((view, 'other'), max(elapsed - measured, 0.0))
+        if sample.commands:
+            request_mongo_commands.inc((view,), sample.commands)
+        if self.slow_seconds is not None and elapsed >= self.slow_seconds:
+            slow_requests.inc((view,))
+            self.log_slow_request(request, view, elapsed, sample)
+
+    def process_template_response(self, request, response):
+        # Called right before the response is rendered; the callback runs right after.
+        sample = _current.get()
+        if sample is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                sample.phases['render'] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, view, elapsed, sample):
+        lines = [
+            f'Slow request {request.method} {request.get_full_path()} ({view}): {elapsed * 1000:.1f} ms, '
+            f'mongo {sample.phases["mongo"] * 1000:.1f} ms in {sample.commands} commands, '
+            f'serialize {sample.phases["serialize"] * 1000:.1f} ms, render {sample.phases["render"] * 1000:.1f} ms'
+        ]
+        for name, command, seconds in sample.command_log:
+            duration = f'{seconds * 1000:.1f} ms' if seconds is not None else 'unfinished'
+            lines.append(f'  {name} {duration}: {_summarize(command)}')
+        logger.warning('\n'.join(lines))
+
+
+def _summarize(command):
+    summary = {
+        key: f'<{len(value)} items>' if key in BULK_COMMAND_KEYS else value
+        for key, value in command.items() if not key.startswith('$') and key != 'lsid'
+    }
+    text = repr(summary)
+    if len(text) > MAX_LOGGED_COMMAND_LENGTH:
+        text = text[:MAX_LOGGED_COMMAND_LENGTH] + '...'
+    return text
+
+
+def exposition():
+    """
+    Every metric in Prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
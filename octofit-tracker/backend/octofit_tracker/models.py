@@ -1,5 +1,7 @@
 from djongo import models
 
+from .indexes import DESCENDING, MongoIndex
+
 
 class User(models.Model):
     _id = models.ObjectIdField(primary_key=True)
@@ -9,6 +11,11 @@ class User(models.Model):
     team = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    mongo_indexes = [
+        MongoIndex('email', unique=True),
+        MongoIndex('team'),
+    ]
+
     class Meta:
         db_table = 'users'
 
@@ -23,6 +30,10 @@ class Team(models.Model):
     members = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    mongo_indexes = [
+        MongoIndex('name', '_id'),
+    ]
+
     class Meta:
         db_table = 'teams'
 
@@ -40,6 +51,12 @@ class Activity(models.Model):
     date = models.DateTimeField()
     notes = models.TextField(blank=True)
 
+    mongo_indexes = [
+        MongoIndex('user_id', ('date', DESCENDING), ('_id', DESCENDING)),
+        MongoIndex('type', ('date', DESCENDING), ('_id', DESCENDING)),
+        MongoIndex(('date', DESCENDING), ('_id', DESCENDING)),
+    ]
+
     class Meta:
         db_table = 'activities'
         verbose_name_plural = 'Activities'
@@ -58,6 +75,13 @@ class Leaderboard(models.Model):
     rank = models.IntegerField()
     last_updated = models.DateTimeField(auto_now=True)
 
+    mongo_indexes = [
+        MongoIndex('user_id', unique=True),
+        MongoIndex('rank', '_id'),
+        MongoIndex(('total_calories', DESCENDING), 'user_id'),
+        MongoIndex('team', 'rank', '_id'),
+    ]
+
     class Meta:
         db_table = 'leaderboard'
         ordering = ['rank']
@@ -75,8 +99,63 @@ class Workout(models.Model):
     description = models.TextField()
     exercises = models.JSONField()
 
+    mongo_indexes = [
+        MongoIndex('name', '_id'),
+        MongoIndex('type', 'difficulty'),
+        MongoIndex('difficulty'),
+    ]
+
     class Meta:
         db_table = 'workouts'
 
     def __str__(self):
         return self.name
+
+
+class ActivityRollup(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    scope = models.CharField(max_length=10)
+    key = models.CharField(max_length=100)
+    period = models.CharField(max_length=10)
+    bucket = models.CharField(max_length=10)
+    type = models.CharField(max_length=50)
+    calories = models.IntegerField()
+    duration = models.IntegerField()
+    distance = models.FloatField()
+    count = models.IntegerField()
+
+    mongo_indexes = [
+        MongoIndex('scope', 'period', 'key', 'bucket', 'type', unique=True),
+    ]
+
+    class Meta:
+        db_table = 'activity_rollups'
+
+    def __str__(self):
+        return f"{self.scope} {self.key} {self.bucket} {self.type}"
+
+
+class LeaderboardSnapshot(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    seq = models.IntegerField()
+    chunk = models.IntegerField()
+    taken_at = models.DateTimeField()
+    keyframe = models.BooleanField()
+    user_ids = models.JSONField()
+    teams = models.JSONField()
+    values = models.BinaryField()
+    removed = models.JSONField()
+
+    mongo_indexes = [
+        MongoIndex('seq', 'chunk', unique=True),
+        MongoIndex('keyframe', 'taken_at'),
+        MongoIndex('taken_at', 'seq'),
+        MongoIndex('user_ids', 'seq'),
+        MongoIndex('removed', 'seq'),
+    ]
+
+    class Meta:
+        db_table = 'leaderboard_snapshots'
+
+    def __str__(self):
+        return f"Snapshot {self.seq}.{self.chunk} at {self.taken_at}"
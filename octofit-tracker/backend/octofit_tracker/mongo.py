@@ -0,0 +1,83 @@
+"""
+Direct pymongo access to the octofit database.
+
+Djongo translates every ORM call through SQL, which cannot express atomic
+in-place updates such as ``$inc`` and adds parsing overhead to every read.
+Code that talks to MongoDB directly goes through ``get_db()``, backed by one
+process-wide ``MongoClient`` (and its connection pool) configured from
+``settings.DATABASES['default']``. The database name is read from the live
+connection settings, so test runs use the test database. Async views await
+the same client through ``run_async``.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from pymongo import MongoClient
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+
+
+def client_options():
+    """
+    MongoClient keyword arguments from the default database's CLIENT setting
+    """
+    return dict(settings.DATABASES['default'].get('CLIENT', {}))
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(**client_options())
+    return _client
+
+
+def get_db():
+    """
+    Return the pymongo Database for the default connection
+    """
+    return get_client()[connection.settings_dict['NAME']]
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                # More threads than pooled connections would only queue inside pymongo.
+                workers = client_options().get('maxPoolSize', 100)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='octofit-mongo')
+    return _executor
+
+
+async def run_async(function, *args, **kwargs):
+    """
+    Await a blocking pymongo call run on the shared MongoDB executor.
+
+    This is how motor drives pymongo too, but over the one client and pool
+    the sync code already uses. The caller's context variables go with the
+    call, so command monitoring still sees which request issued it.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(context.run, function, *args, **kwargs)
+    )
+
+
+def as_document(instance):
+    """
+    Snapshot a model instance as a plain dict keyed by column name
+    """
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+    }
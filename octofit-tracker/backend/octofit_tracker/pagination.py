@@ -0,0 +1,150 @@
+"""
+Keyset (cursor) pagination for the API list endpoints.
+
+Each viewset names a unique sort key in ``keyset_ordering`` (the last column
+must be unique, usually ``_id``). A page is fetched as "rows after the last
+row of the previous page" plus a LIMIT, so there is no skip and no COUNT and
+deep pages cost the same as the first one. The cursor is the last row's key
+values, JSON-encoded and base64'd so clients treat it as opaque.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from bson.errors import InvalidId
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        position = self.prepare(request, view, queryset.model)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return self.trim(list(queryset[:self.page_size + 1]), getattr)
+
+    def paginate_repository(self, repository, request, view, filter=None, fields=None):
+        """
+        Same as paginate_queryset, but for a native Repository read
+        """
+        query, sort, limit = self.repository_query(request, view, filter)
+        return self.trim(list(repository.find(query, sort=sort, limit=limit, fields=fields)), document_value)
+
+    def repository_query(self, request, view, filter=None):
+        """
+        (filter, sort, limit) selecting the requested page plus one row; pair with trim()
+        """
+        position = self.prepare(request, view, view.queryset.model)
+        conditions = [filter] if filter else []
+        if position is not None:
+            conditions.append(self.mongo_after(position))
+        sort = [(name.lstrip('-'), -1 if name.startswith('-') else 1) for name in self.ordering]
+        query = {'$and': conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+        return query, sort, self.page_size + 1
+
+    def prepare(self, request, view, model):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'keyset_ordering', ('_id',)))
+        self.page_size = self.get_page_size(request)
+        return self.decode_cursor(request, model)
+
+    def trim(self, rows, get_value):
+        # One extra row tells us whether there is a next page without counting.
+        self.next_position = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_position = [get_value(rows[-1], name.lstrip('-')) for name in self.ordering]
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        return None
+
+    def after(self, position):
+        """
+        Q matching rows strictly after `position` in keyset order
+        """
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def mongo_after(self, position):
+        """
+        The same predicate as after(), as a MongoDB filter
+        """
+        branches = []
+        equal = {}
+        for name, value in zip(self.ordering, position):
+            field = name.lstrip('-')
+            operator = '$lt' if name.startswith('-') else '$gt'
+            branches.append({**equal, field: {operator: value}})
+            equal[field] = value
+        return {'$or': branches} if len(branches) > 1 else branches[0]
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if isinstance(value, datetime) else str(value) for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (binascii.Error, ValueError, TypeError, ValidationError, InvalidId):
+            raise NotFound(self.invalid_cursor_message)
+
+
+def document_value(document, name):
+    return document.get(name)
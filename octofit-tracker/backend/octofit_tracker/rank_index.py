@@ -0,0 +1,231 @@
+"""
+In-process order-statistic index over the leaderboard.
+
+``RankIndex`` is an indexable skip list: every forward link also records how
+many bottom-level positions it spans, so inserts, removals, rank lookups and
+positional access all run in O(log n). One index covers the whole board and
+one more is kept per team. They are loaded lazily from the leaderboard
+collection, kept current by ``leaderboard.apply_deltas`` and reloaded after
+``OCTOFIT_RANK_INDEX_TTL`` seconds so writes from other processes show up.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .mongo import get_db
+
+MAX_LEVEL = 24
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class RankIndex:
+    """
+    Skip list of members ordered by score, highest first (ties by member)
+    """
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVEL)
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, member):
+        return member in self._scores
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def update(self, member, score):
+        """
+        Insert a member or move it to a new score
+        """
+        if member in self._scores:
+            if self._scores[member] == score:
+                return
+            self._remove((-self._scores[member], member))
+        self._scores[member] = score
+        self._insert((-score, member))
+
+    def discard(self, member):
+        if member in self._scores:
+            self._remove((-self._scores.pop(member), member))
+
+    def rank(self, member):
+        """
+        1-based position of a member, or None if it is not indexed
+        """
+        if member not in self._scores:
+            return None
+        key = (-self._scores[member], member)
+        node, position = self._head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position + 1
+
+    def range(self, start, stop):
+        """
+        (member, score, rank) for 0-based positions start <= i < stop
+        """
+        start = max(start, 0)
+        stop = min(stop, len(self._scores))
+        if start >= stop:
+            return []
+        node, remaining = self._head, start + 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        items = []
+        for rank in range(start + 1, stop + 1):
+            score, member = node.key
+            items.append((member, -score, rank))
+            node = node.next[0]
+        return items
+
+    def _insert(self, key):
+        update = [None] * MAX_LEVEL
+        steps = [0] * MAX_LEVEL
+        node, position = self._head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            steps[level] = position
+        height = 1
+        while height < MAX_LEVEL and random.random() < 0.5:
+            height += 1
+        new = _Node(key, height)
+        for level in range(height):
+            previous = update[level]
+            skipped = position - steps[level]
+            new.next[level] = previous.next[level]
+            new.width[level] = previous.width[level] - skipped
+            previous.next[level] = new
+            previous.width[level] = skipped + 1
+        for level in range(height, MAX_LEVEL):
+            update[level].width[level] += 1
+
+    def _remove(self, key):
+        update = [None] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            update[level] = node
+        target = node.next[0]
+        for level in range(MAX_LEVEL):
+            if update[level].next[level] is target:
+                update[level].width[level] += target.width[level] - 1
+                update[level].next[level] = target.next[level]
+            else:
+                update[level].width[level] -= 1
+
+
+_lock = threading.RLock()
+_board = None
+_teams = {}
+_loaded_at = 0.0
+
+
+def _load():
+    global _board, _teams, _loaded_at
+    board, teams = RankIndex(), {}
+    rows = get_db().leaderboard.find({}, {'user_id': 1, 'team': 1, 'total_calories': 1, '_id': 0})
+    for row in rows:
+        user_id = str(row['user_id'])
+        board.update(user_id, row['total_calories'])
+        teams.setdefault(row.get('team', ''), RankIndex()).update(user_id, row['total_calories'])
+    _board, _teams, _loaded_at = board, teams, time.monotonic()
+
+
+def _ensure_loaded():
+    ttl = getattr(settings, 'OCTOFIT_RANK_INDEX_TTL', 60)
+    if _board is None or time.monotonic() - _loaded_at > ttl:
+        _load()
+
+
+def top(k, team=None):
+    """
+    The first k (user_id, total_calories, rank) entries of the board or a team
+    """
+    with _lock:
+        _ensure_loaded()
+        index = _board if team is None else _teams.get(team, RankIndex())
+        return index.range(0, k)
+
+
+def around(user_id, window, team=None):
+    """
+    Entries within `window` positions of a user, or None if the user is not ranked
+    """
+    with _lock:
+        _ensure_loaded()
+        index = _board if team is None else _teams.get(team, RankIndex())
+        rank = index.rank(user_id)
+        if rank is None:
+            return None
+        return index.range(rank - 1 - window, rank + window)
+
+
+def rank_of(user_id, team=None):
+    with _lock:
+        _ensure_loaded()
+        index = _board if team is None else _teams.get(team, RankIndex())
+        return index.rank(user_id)
+
+
+def warm():
+    """
+    Load the index now if it is not loaded or is older than the TTL
+    """
+    with _lock:
+        _ensure_loaded()
+
+
+def loaded_ranks(user_ids):
+    """
+    {user_id: rank} from the index as loaded, without loading it; {} if it is not loaded or being reloaded
+    """
+    # Never waits for a reload from MongoDB, so callers on latency-sensitive threads do not stall.
+    if not _lock.acquire(blocking=False):
+        return {}
+    try:
+        if _board is None:
+            return {}
+        return {user_id: _board.rank(user_id) for user_id in user_ids}
+    finally:
+        _lock.release()
+
+
+def record(user_id, team, total_calories):
+    """
+    Mirror a leaderboard write into the loaded index (no-op if not loaded)
+    """
+    with _lock:
+        if _board is None:
+            return
+        _board.update(user_id, total_calories)
+        _teams.setdefault(team, RankIndex()).update(user_id, total_calories)
+
+
+def invalidate():
+    """
+    Drop the index so the next lookup reloads it from the collection
+    """
+    global _board
+    with _lock:
+        _board = None
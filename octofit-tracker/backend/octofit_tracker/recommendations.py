@@ -0,0 +1,121 @@
+"""
+Workout recommendations scored against a user's recent activity mix.
+
+Users and workouts are described in one feature space of three blocks:
+activity type, duration bucket and intensity level. A user's vector holds
+the share of their last ``OCTOFIT_RECOMMENDATION_HISTORY`` activities in
+each type, duration bucket and intensity level (calories per minute); a
+workout's vector is one-hot in each block (its type, its duration's bucket,
+its difficulty). With the blocks weighted by ``BLOCK_WEIGHTS``, a workout's
+score is the weighted share of the user's recent activities that match it,
+between 0 and 1, and scoring every workout is one matrix-vector product.
+
+The workout matrix and the workouts' API representation are built once and
+cached in ``workout_matrix`` until a workout is written through the API or
+``OCTOFIT_RECOMMENDATION_TTL`` seconds pass.
+"""
+import numpy as np
+from django.conf import settings
+
+from .caching import CachedValue
+from .mongo import get_db
+from .repository import Repository
+from .serializers import WorkoutSerializer
+
+# Upper bounds in minutes; the last bucket is open-ended.
+DURATION_BUCKETS = (20, 40, 60, 90)
+# Calories per minute separating light, moderate and hard activities.
+INTENSITY_BOUNDS = (6, 10)
+DIFFICULTY_LEVELS = {'beginner': 0, 'intermediate': 1, 'advanced': 2}
+BLOCK_WEIGHTS = {'type': 0.6, 'duration': 0.2, 'intensity': 0.2}
+
+_workouts = Repository('workouts', WorkoutSerializer)
+
+
+class WorkoutMatrix:
+    """
+    Every workout as a row of block-weighted one-hot features
+    """
+
+    def __init__(self, workouts):
+        self.types = sorted({workout['type'] for workout in workouts})
+        self.type_columns = {activity_type: column for column, activity_type in enumerate(self.types)}
+        self.workouts = [_workouts.to_wire(workout) for workout in workouts]
+        self._duration_offset = len(self.types)
+        self._intensity_offset = self._duration_offset + len(DURATION_BUCKETS) + 1
+        width = self._intensity_offset + len(INTENSITY_BOUNDS) + 1
+        self.vectors = np.zeros((len(workouts), width), dtype=np.float32)
+        rows = np.arange(len(workouts))
+        type_columns = np.array([self.type_columns[workout['type']] for workout in workouts], dtype=np.intp)
+        durations = np.array([workout['duration'] for workout in workouts], dtype=np.float32)
+        self.vectors[rows, type_columns] = BLOCK_WEIGHTS['type']
+        self.vectors[rows, self._duration_offset + np.searchsorted(DURATION_BUCKETS, durations)] = \
+            BLOCK_WEIGHTS['duration']
+        for row, workout in enumerate(workouts):
+            level = DIFFICULTY_LEVELS.get(workout.get('difficulty'))
+            if level is None:
+                # Unknown difficulty matches every intensity a little.
+                self.vectors[row, self._intensity_offset:] = BLOCK_WEIGHTS['intensity'] / len(DIFFICULTY_LEVELS)
+            else:
+                self.vectors[row, self._intensity_offset + level] = BLOCK_WEIGHTS['intensity']
+
+    def user_vector(self, activities):
+        """
+        Shares of the activities per type, duration bucket and intensity level
+        """
+        width = self.vectors.shape[1]
+        if not activities:
+            return np.zeros(width, dtype=np.float32)
+        types = (self.type_columns.get(activity['type']) for activity in activities)
+        known = [column for column in types if column is not None]
+        values = np.array([(activity['duration'], activity['calories']) for activity in activities], dtype=np.float32)
+        durations, calories = values[:, 0], values[:, 1]
+        intensity = calories / np.maximum(durations, 1)
+        columns = np.concatenate((
+            np.array(known, dtype=np.intp),
+            self._duration_offset + np.searchsorted(DURATION_BUCKETS, durations),
+            self._intensity_offset + np.searchsorted(INTENSITY_BOUNDS, intensity, side='right'),
+        ))
+        # Types no workout offers still count in the denominator.
+        return (np.bincount(columns, minlength=width) / len(activities)).astype(np.float32)
+
+    def top(self, user_vector, limit):
+        """
+        (row, score) of the `limit` best-scoring workouts, best first
+        """
+        scores = self.vectors @ user_vector
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        candidates = np.argpartition(-scores, limit - 1)[:limit] if limit < len(scores) else np.arange(len(scores))
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(row), float(scores[row])) for row in order]
+
+
+def build_workout_matrix():
+    return WorkoutMatrix(list(_workouts.find(sort=[('_id', 1)])))
+
+
+workout_matrix = CachedValue(build_workout_matrix, ttl=getattr(settings, 'OCTOFIT_RECOMMENDATION_TTL', 300))
+
+
+def recent_activities(user_id, limit=None):
+    limit = limit or getattr(settings, 'OCTOFIT_RECOMMENDATION_HISTORY', 50)
+    return list(
+        get_db().activities.find({'user_id': user_id}, {'_id': 0, 'type': 1, 'duration': 1, 'calories': 1})
+        .sort([('date', -1), ('_id', -1)])
+        .limit(limit)
+    )
+
+
+def recommend(user_id, limit=10):
+    """
+    {'based_on': activity count, 'results': [workout + score]} for a user, best match first
+    """
+    matrix = workout_matrix.get()
+    activities = recent_activities(user_id)
+    results = [
+        {**matrix.workouts[row], 'score': round(score, 4)}
+        for row, score in matrix.top(matrix.user_vector(activities), limit)
+    ]
+    return {'based_on': len(activities), 'results': results}
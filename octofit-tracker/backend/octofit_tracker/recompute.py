@@ -0,0 +1,149 @@
+"""
+Background maintenance of the data derived from activities.
+
+Activity writes only queue their change here (see ``activity_hooks``) and
+mark the users they touch as dirty. One worker thread, started lazily by the
+first ``submit`` or ``drain`` in a process, waits until no write has arrived
+for ``OCTOFIT_RECOMPUTE_DEBOUNCE`` seconds, or until the oldest queued write
+is ``OCTOFIT_RECOMPUTE_MAX_DELAY`` seconds old, then takes everything queued
+as one batch: the leaderboard rows of the dirty users are re-aggregated and
+re-ranked, the rollup deltas of all queued writes are applied together, the
+team feeds are updated and the users' memoized stats are dropped. A burst of writes by one user therefore
+costs one recompute, and the request that wrote the activity does none of it.
+Queue depth and lag are exported on /metrics. Changes still queued when the
+process exits are lost; the ``rebuild_rollups`` command and
+``leaderboard.resync_users`` repair them.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from . import analytics, leaderboard, rollups, team_feed
+from .metrics import Counter, Gauge, Histogram, register
+
+logger = logging.getLogger(__name__)
+
+
+class RecomputeWorker:
+    """
+    Debounces submitted changes and hands them to `process` in batches, on one thread
+    """
+
+    def __init__(self, process, debounce=0.2, max_delay=2.0):
+        self.process = process
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._changes = []
+        self._dirty = set()
+        self._first_at = None
+        self._last_at = None
+        self._busy = False
+        self._flush = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            # A forked worker process inherits the object but not the thread.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='octofit-recompute', daemon=True)
+                self._thread.start()
+
+    def submit(self, added=(), removed=()):
+        """
+        Queue one write's (added, removed) activity documents
+        """
+        self.start()
+        now = time.monotonic()
+        with self._condition:
+            self._changes.append((list(added), list(removed)))
+            self._dirty.update(str(activity['user_id']) for activity in (*added, *removed))
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+            self._condition.notify_all()
+
+    def depth(self):
+        """
+        Dirty users waiting for a recompute
+        """
+        return len(self._dirty)
+
+    def lag(self):
+        """
+        Seconds since the oldest write still waiting was queued
+        """
+        first_at = self._first_at
+        return 0.0 if first_at is None else time.monotonic() - first_at
+
+    def drain(self, timeout=None):
+        """
+        Process everything queued now and wait for it; False if `timeout` passes first
+        """
+        self.start()
+        with self._condition:
+            self._flush = bool(self._changes)
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._changes and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._changes)
+                while not self._flush:
+                    due = min(self._last_at + self.debounce, self._first_at + self.max_delay)
+                    remaining = due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                changes, dirty, first_at = self._changes, self._dirty, self._first_at
+                self._changes, self._dirty, self._first_at, self._flush = [], set(), None, False
+                self._busy = True
+            start = time.monotonic()
+            try:
+                self.process(changes, dirty)
+            except Exception:
+                batch_failures.inc(())
+                logger.exception('Recompute of %d users failed', len(dirty))
+            finally:
+                batch_duration.observe((), time.monotonic() - start)
+                batch_lag.observe((), time.monotonic() - first_at)
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+def propagate(changes, user_ids):
+    """
+    Bring every derived collection up to date with the queued (added, removed) changes
+    """
+    teams = rollups.user_teams(user_ids)
+    leaderboard.resync_users(user_ids)
+    added = [activity for batch_added, _ in changes for activity in batch_added]
+    removed = [activity for _, batch_removed in changes for activity in batch_removed]
+    rollups.apply_deltas(rollups.activity_deltas(added, removed, teams=teams))
+    for batch_added, batch_removed in changes:
+        team_feed.activities_changed(batch_added, batch_removed, teams)
+    analytics.invalidate(user_ids)
+
+
+worker = RecomputeWorker(
+    propagate,
+    debounce=getattr(settings, 'OCTOFIT_RECOMPUTE_DEBOUNCE', 0.2),
+    max_delay=getattr(settings, 'OCTOFIT_RECOMPUTE_MAX_DELAY', 2.0),
+)
+
+batch_duration = Histogram(
+    'octofit_recompute_batch_duration_seconds', 'Time to recompute one batch of dirty users.', ())
+batch_lag = Histogram(
+    'octofit_recompute_lag_seconds', 'Time from the oldest write in a batch to its recompute finishing.', ())
+batch_failures = Counter('octofit_recompute_failures_total', 'Recompute batches that raised.', ())
+register(
+    Gauge('octofit_recompute_queue_depth', 'Dirty users waiting for a recompute.', worker.depth),
+    Gauge('octofit_recompute_queue_lag_seconds', 'Age of the oldest write waiting for a recompute.', worker.lag),
+    batch_duration,
+    batch_lag,
+    batch_failures,
+)
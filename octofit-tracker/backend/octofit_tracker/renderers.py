@@ -0,0 +1,157 @@
+"""
+Extra renderers for the API.
+
+ORJSONRenderer and MessagePackRenderer are the API's default renderers (see
+``REST_FRAMEWORK`` in settings). ORJSONRenderer produces the same JSON as
+DRF's JSONRenderer: ObjectIds and datetimes are encoded natively, everything
+else orjson has no type for goes through DRF's encoder, and data orjson
+cannot encode like DRF (non-string keys, integers beyond 64 bits, NumPy
+or Decimal NaNs and infinities, which DRF rejects) or an indented response
+falls back to the stdlib encoder. Python floats are not searched for NaN
+and infinities, which orjson writes as null: the serializers' compiled
+FloatField converters already reject them (see ``fast_serializers``). The
+bytes are the same too, except for floats from 1e16 or below 1e-4 in
+magnitude, which orjson spells differently (1e16 for 1e+16, 0.00001 for
+1e-05) but which parse to the same values. MessagePackRenderer
+encodes the same values as the JSON renderers, with datetimes as the same
+ISO strings, for clients that send ``Accept: application/msgpack``.
+
+NDJSONRenderer and CSVRenderer exist mainly so content negotiation accepts
+``?format=ndjson`` and ``?format=csv``; streaming endpoints call their
+``stream()`` generator directly instead of rendering a complete response.
+"""
+import csv
+import io
+import math
+
+import msgpack
+import orjson
+from bson import ObjectId
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """
+    DRF's encoder, plus ObjectIds as their hex string
+    """
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    """
+    A JSON-compatible stand-in for a value orjson or msgpack cannot encode
+    """
+    return _encoder.default(obj)
+
+
+def _finite(value):
+    # False if a float anywhere in `value` is NaN or infinite.
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, dict):
+        return all(_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_finite(item) for item in value)
+    return True
+
+
+def _orjson_default(obj):
+    value = encode_default(obj)
+    if not _finite(value):
+        # Raised as JSONEncodeError, so the stdlib encoder rejects it like DRF does.
+        raise TypeError('Out of range float values are not JSON compliant')
+    return value
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, int):
+        raise OverflowError(f'{obj} does not fit in a 64-bit MessagePack integer')
+    return encode_default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    encoder_class = JSONEncoder
+    # Without OPT_UTC_Z orjson writes UTC as +00:00 where DRF writes Z.
+    options = orjson.OPT_UTC_Z
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_orjson_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer does, to stay a strict JavaScript subset.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, datetime=False)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(self.stream(data if isinstance(data, list) else [data]))
+
+    def stream(self, rows, batch_size=1000):
+        """
+        Yield newline-delimited JSON, one chunk per `batch_size` rows
+        """
+        chunk = []
+        for row in rows:
+            chunk.append(orjson.dumps(row, default=encode_default, option=orjson.OPT_UTC_Z))
+            if len(chunk) >= batch_size:
+                yield b'\n'.join(chunk) + b'\n'
+                chunk = []
+        if chunk:
+            yield b'\n'.join(chunk) + b'\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        fields = list(rows[0]) if rows else []
+        return ''.join(self.stream(rows, fields)).encode()
+
+    def stream(self, rows, fields, batch_size=1000):
+        """
+        Yield a header line, then CSV text one chunk per `batch_size` rows
+        """
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -0,0 +1,106 @@
+"""
+Native MongoDB read path for the hot API endpoints.
+
+Djongo turns every ORM query into SQL, re-parses it and only then talks to
+MongoDB. For read-heavy endpoints that translation costs more than the query,
+so ``Repository`` queries the collection directly through the shared pymongo
+client and converts documents with the serializer's compiled row converter,
+producing exactly the dicts the serializer would. ``async_get`` and
+``async_find`` are the same reads for async views. Every read takes an
+optional ``fields`` subset (a sparse fieldset): only those fields, plus any
+sort keys, are projected in MongoDB, and ``to_wire`` emits only those.
+"""
+import time
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from .fast_serializers import row_converter
+from .metrics import record_phase
+from .mongo import get_db, run_async
+
+
+class Repository:
+    """
+    Read-only access to one collection, rendered through a serializer's fields
+    """
+
+    def __init__(self, collection, serializer_class):
+        self.collection = collection
+        self.serializer_class = serializer_class
+        self._converters = {}
+        self._projection = None
+
+    @property
+    def projection(self):
+        if self._projection is None:
+            self._projection = {
+                name: 1 for name, field in self.serializer_class().fields.items() if not field.write_only
+            }
+        return self._projection
+
+    def projection_for(self, fields=None, sort=None):
+        """
+        The projection reading only `fields` (all readable fields if None) and the sort keys
+        """
+        if fields is None:
+            return self.projection
+        projection = dict.fromkeys(fields, 1)
+        projection.update((name, 1) for name, _ in sort or ())
+        return projection
+
+    def get(self, pk, fields=None):
+        """
+        The document with the given _id, or None
+        """
+        pk = _object_id(pk)
+        if pk is None:
+            return None
+        return get_db()[self.collection].find_one({'_id': pk}, self.projection_for(fields))
+
+    def find(self, filter=None, sort=None, limit=0, fields=None):
+        cursor = get_db()[self.collection].find(filter or {}, self.projection_for(fields, sort))
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.limit(limit)
+
+    async def async_get(self, pk, fields=None):
+        return await run_async(self.get, pk, fields)
+
+    async def async_find(self, filter=None, sort=None, limit=0, fields=None):
+        """
+        find() as a list, without blocking the event loop
+        """
+        return await run_async(lambda: list(self.find(filter, sort, limit, fields)))
+
+    def to_wire(self, document, fields=None):
+        """
+        Convert a document to the serializer's output format, keeping only `fields` if given
+        """
+        return self._converter(fields)(document)
+
+    def to_wire_list(self, documents, fields=None):
+        """
+        to_wire() over a page of documents, timed as one serialize observation
+        """
+        # Exhaust the cursor first so only the conversion counts as serialization.
+        documents = list(documents)
+        convert = self._converter(fields)
+        start = time.perf_counter()
+        data = [convert(document) for document in documents]
+        record_phase('serialize', time.perf_counter() - start)
+        return data
+
+    def _converter(self, fields):
+        convert = self._converters.get(fields)
+        if convert is None:
+            # Built on first use: instantiating serializer fields needs the app registry.
+            convert = self._converters[fields] = row_converter(self.serializer_class(fields=fields))
+        return convert
+
+
+def _object_id(pk):
+    try:
+        return ObjectId(pk)
+    except (InvalidId, TypeError):
+        return None
@@ -0,0 +1,136 @@
+"""
+Materialized activity rollups.
+
+``activity_rollups`` holds one document per (scope, key, period, bucket,
+type): scope is "user" (key = user_id) or "team" (key = team name), period
+is "day" (bucket "2024-05-01") or "week" (ISO week, bucket "2024-W18").
+Activity writes are folded into bucket deltas and applied with upserting
+``$inc``; ``rebuild`` recomputes everything from the activities collection.
+"""
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from bson import ObjectId
+from pymongo import DeleteMany, UpdateOne
+
+from .mongo import get_db
+
+BATCH_SIZE = 1000
+VALUE_FIELDS = ('calories', 'duration', 'distance', 'count')
+
+
+def buckets(date):
+    """
+    {period: bucket label} for an activity date
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(dt_timezone.utc)
+    year, week, _ = date.isocalendar()
+    return {'day': date.date().isoformat(), 'week': f'{year}-W{week:02d}'}
+
+
+def user_teams(user_ids, db=None):
+    """
+    {user_id: team} for the given user ids, in one query
+    """
+    db = db if db is not None else get_db()
+    object_ids = [ObjectId(user_id) for user_id in set(user_ids) if ObjectId.is_valid(user_id)]
+    return {
+        str(user['_id']): user.get('team', '')
+        for user in db.users.find({'_id': {'$in': object_ids}}, {'team': 1})
+    }
+
+
+def activity_deltas(added=(), removed=(), teams=None):
+    """
+    Fold activity documents into {(scope, key, period, bucket, type): [calories, duration, distance, count]}
+    """
+    if teams is None:
+        teams = user_teams([str(activity['user_id']) for activity in (*added, *removed)])
+    deltas = defaultdict(lambda: [0, 0, 0.0, 0])
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            _accumulate(deltas, activity, sign, teams)
+    return dict(deltas)
+
+
+def _accumulate(totals, activity, sign, teams):
+    user_id = str(activity['user_id'])
+    scopes = [('user', user_id)]
+    if teams.get(user_id):
+        scopes.append(('team', teams[user_id]))
+    for period, bucket in buckets(activity['date']).items():
+        for scope, key in scopes:
+            total = totals[(scope, key, period, bucket, activity['type'])]
+            total[0] += sign * activity['calories']
+            total[1] += sign * activity['duration']
+            total[2] += sign * (activity.get('distance') or 0)
+            total[3] += sign
+
+
+def apply_deltas(deltas, db=None):
+    db = db if db is not None else get_db()
+    operations = []
+    for (scope, key, period, bucket, activity_type), values in deltas.items():
+        if not any(values):
+            continue
+        bucket_filter = {'scope': scope, 'key': key, 'period': period, 'bucket': bucket, 'type': activity_type}
+        operations.append(UpdateOne(bucket_filter, {'$inc': dict(zip(VALUE_FIELDS, values))}, upsert=True))
+        if values[3] < 0:
+            # Drop buckets whose last activity was removed.
+            operations.append(DeleteMany({**bucket_filter, 'count': {'$lte': 0}}))
+    for start in range(0, len(operations), BATCH_SIZE):
+        db.activity_rollups.bulk_write(operations[start:start + BATCH_SIZE])
+
+
+def rebuild(db=None):
+    """
+    Recompute every rollup from the activities collection; returns the bucket count
+    """
+    db = db if db is not None else get_db()
+    teams = {str(user['_id']): user.get('team', '') for user in db.users.find({}, {'team': 1})}
+    projection = {'user_id': 1, 'type': 1, 'date': 1, 'calories': 1, 'duration': 1, 'distance': 1}
+    # Memory grows with the number of buckets, not the number of activities.
+    totals = defaultdict(lambda: [0, 0, 0.0, 0])
+    for activity in db.activities.find({}, projection, batch_size=BATCH_SIZE):
+        _accumulate(totals, activity, 1, teams)
+
+    db.activity_rollups.delete_many({})
+    documents = [
+        {'scope': scope, 'key': key, 'period': period, 'bucket': bucket, 'type': activity_type,
+         **dict(zip(VALUE_FIELDS, values))}
+        for (scope, key, period, bucket, activity_type), values in totals.items()
+    ]
+    for start in range(0, len(documents), BATCH_SIZE):
+        db.activity_rollups.insert_many(documents[start:start + BATCH_SIZE], ordered=False)
+    return len(documents)
+
+
+def query(scope, period, key=None, start=None, end=None, activity_type=None):
+    """
+    Buckets merged across activity types, each with a per-type breakdown
+    """
+    criteria = {'scope': scope, 'period': period}
+    if key is not None:
+        criteria['key'] = key
+    if start or end:
+        criteria['bucket'] = {}
+        if start:
+            criteria['bucket']['$gte'] = start
+        if end:
+            criteria['bucket']['$lte'] = end
+    if activity_type:
+        criteria['type'] = activity_type
+
+    merged = {}
+    documents = get_db().activity_rollups.find(criteria, {'_id': 0}).sort([('key', 1), ('bucket', 1)])
+    for document in documents:
+        row = merged.setdefault((document['key'], document['bucket']), {
+            'key': document['key'], 'bucket': document['bucket'],
+            'calories': 0, 'duration': 0, 'distance': 0.0, 'count': 0, 'by_type': {},
+        })
+        values = {name: document[name] for name in VALUE_FIELDS}
+        for name, value in values.items():
+            row[name] += value
+        row['by_type'][document['type']] = values
+    return list(merged.values())
@@ -1,35 +1,53 @@
 from rest_framework import serializers
+from .fast_serializers import FastListSerializer
 from .models import User, Team, Activity, Leaderboard, Workout
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Takes fields=[...] to keep only those of the serializer's fields
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['_id', 'name', 'email', 'password', 'team', 'created_at']
+        list_serializer_class = FastListSerializer
         extra_kwargs = {
             'password': {'write_only': True}
         }
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'members', 'created_at']
+        list_serializer_class = FastListSerializer
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'type', 'duration', 'distance', 'calories', 'date', 'notes']
+        list_serializer_class = FastListSerializer
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Leaderboard
         fields = ['_id', 'user_id', 'team', 'total_calories', 'total_duration', 'total_distance', 'rank', 'last_updated']
+        list_serializer_class = FastListSerializer
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'type', 'duration', 'difficulty', 'description', 'exercises']
+        list_serializer_class = FastListSerializer
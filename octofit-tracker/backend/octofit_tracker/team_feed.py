@@ -0,0 +1,158 @@
+"""
+Recent activity per team, kept in bounded in-process ring buffers.
+
+Each team's feed holds its newest ``OCTOFIT_TEAM_FEED_SIZE`` activities in
+the order they were logged, already converted to their API representation.
+A feed is built on first read from the team members' latest activities (one
+indexed query), kept current by ``activities_changed`` and rebuilt after
+``OCTOFIT_TEAM_FEED_TTL`` seconds so writes from other processes show up.
+Reading a page walks back from a position in the ring, so it costs
+O(page size) whatever the team's size or activity history.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .mongo import get_db
+from .repository import Repository
+from .serializers import ActivitySerializer
+
+_activities = Repository('activities', ActivitySerializer)
+
+
+class TeamFeed:
+    """
+    Ring buffer of a team's newest activities, numbered in arrival order
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._next = 0
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def push(self, activity_id, event):
+        slot = self._next % self.capacity
+        evicted = self._slots[slot]
+        if evicted is not None:
+            del self._positions[evicted[0]]
+        self._slots[slot] = (activity_id, event)
+        self._positions[activity_id] = self._next
+        self._next += 1
+
+    def replace(self, activity_id, event):
+        """
+        Update an event in place; False if the activity is not in the feed
+        """
+        position = self._positions.get(activity_id)
+        if position is None:
+            return False
+        self._slots[position % self.capacity] = (activity_id, event)
+        return True
+
+    def remove(self, activity_id):
+        position = self._positions.pop(activity_id, None)
+        if position is not None:
+            self._slots[position % self.capacity] = None
+
+    def page(self, limit, before=None):
+        """
+        Up to `limit` + 1 (activity_id, event) pairs, newest first, older than activity `before`.
+
+        Raises KeyError if `before` is no longer in the feed.
+        """
+        oldest = max(0, self._next - self.capacity)
+        position = (self._next if before is None else self._positions[before]) - 1
+        entries = []
+        while position >= oldest and len(entries) <= limit:
+            entry = self._slots[position % self.capacity]
+            if entry is not None:
+                entries.append(entry)
+            position -= 1
+        return entries
+
+
+_lock = threading.Lock()
+_feeds = {}
+# {team: [changes]} for every feed being read from MongoDB, so that writes
+# arriving during the read are replayed onto it before it is swapped in.
+_loading = {}
+
+
+def _load(team):
+    db = get_db()
+    capacity = getattr(settings, 'OCTOFIT_TEAM_FEED_SIZE', 200)
+    member_ids = [str(user['_id']) for user in db.users.find({'team': team}, {'_id': 1})]
+    documents = list(
+        db.activities.find({'user_id': {'$in': member_ids}}, _activities.projection)
+        .sort([('date', -1), ('_id', -1)])
+        .limit(capacity)
+    )
+    feed = TeamFeed(capacity)
+    for document in reversed(documents):
+        feed.push(str(document['_id']), _activities.to_wire(document))
+    return feed
+
+
+def page(team, limit, before=None):
+    """
+    Up to `limit` + 1 newest (activity_id, activity) pairs of a team's feed, older than `before`
+    """
+    ttl = getattr(settings, 'OCTOFIT_TEAM_FEED_TTL', 60)
+    with _lock:
+        feed, loaded_at = _feeds.get(team, (None, 0.0))
+        if feed is not None and time.monotonic() - loaded_at <= ttl:
+            return feed.page(limit, before)
+        changes = []
+        _loading.setdefault(team, []).append(changes)
+    # Read outside the lock so other teams' reads and the recompute worker are not held up.
+    try:
+        feed = _load(team)
+    finally:
+        with _lock:
+            _loading[team].remove(changes)
+            if not _loading[team]:
+                del _loading[team]
+    with _lock:
+        for added, removed, teams in changes:
+            _apply({team: feed}, added, removed, teams)
+        _feeds[team] = (feed, time.monotonic())
+        return feed.page(limit, before)
+
+
+def activities_changed(added, removed, teams):
+    """
+    Mirror activity writes into the loaded feeds (teams: {user_id: team})
+    """
+    with _lock:
+        if not _feeds and not _loading:
+            return
+        for pending in _loading.values():
+            for changes in pending:
+                changes.append((added, removed, teams))
+        _apply({team: feed for team, (feed, _) in _feeds.items()}, added, removed, teams)
+
+
+def _apply(feeds, added, removed, teams):
+    added_to = {str(activity['_id']): teams.get(str(activity['user_id'])) for activity in added}
+    for activity in removed:
+        activity_id, team = str(activity['_id']), teams.get(str(activity['user_id']))
+        # An update is a removal plus an addition; keep its place in the same team's feed.
+        if team in feeds and added_to.get(activity_id) != team:
+            feeds[team].remove(activity_id)
+    for activity in added:
+        activity_id, team = str(activity['_id']), added_to[str(activity['_id'])]
+        if team in feeds:
+            feed = feeds[team]
+            event = _activities.to_wire(activity)
+            if not feed.replace(activity_id, event):
+                feed.push(activity_id, event)
+
+
+def invalidate():
+    with _lock:
+        _feeds.clear()
@@ -1,8 +1,51 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+from unittest import mock
+from decimal import Decimal
+
+import msgpack
+import numpy as np
+from asgiref.sync import async_to_sync
+from bson import ObjectId
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, Workout
+from .serializers import (
+    ActivitySerializer,
+    LeaderboardSerializer,
+    TeamSerializer,
+    UserSerializer,
+    WorkoutSerializer
+)
+from . import (
+    analytics, leaderboard, leaderboard_history, leaderboard_stream, rank_index, recommendations, recompute, team_feed
+)
+from .caching import response_cache
+from .mongo import get_db
+from .filters import compile_filters
+from .parsers import MessagePackParser, ORJSONParser
+from .indexes import declared_indexes, ensure_indexes
+from .leaderboard_stream import Broadcaster
+from .management.commands.import_activities import Command as ImportCommand
+from .metrics import Histogram, exposition
+from .rank_index import RankIndex
+from .recommendations import WorkoutMatrix
+from .recompute import RecomputeWorker
+from .renderers import MessagePackRenderer, ORJSONRenderer
+from .team_feed import TeamFeed
+from .views import ActivityViewSet, LeaderboardViewSet
+from datetime import date, datetime, timezone
 
 
 class UserModelTest(TestCase):
@@ -187,6 +230,912 @@ class LeaderboardAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class LeaderboardMaintenanceTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def post_activity(self, user_id, calories):
+        response = self.client.post('/api/activities/', {
+            "user_id": user_id,
+            "type": "running",
+            "duration": 30,
+            "distance": 5.0,
+            "calories": calories,
+            "date": datetime.now().isoformat(),
+        }, format='json')
+        recompute.worker.drain()
+        return response
+
+    def test_create_activity_updates_leaderboard(self):
+        self.post_activity("507f1f77bcf86cd799439011", 300)
+        self.post_activity("507f1f77bcf86cd799439011", 200)
+        entry = Leaderboard.objects.get(user_id="507f1f77bcf86cd799439011")
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_duration, 60)
+        self.assertEqual(entry.rank, 1)
+
+    def test_overtaking_user_swaps_ranks(self):
+        self.post_activity("507f1f77bcf86cd799439011", 300)
+        self.post_activity("507f1f77bcf86cd799439012", 200)
+        self.assertEqual(Leaderboard.objects.get(user_id="507f1f77bcf86cd799439012").rank, 2)
+        self.post_activity("507f1f77bcf86cd799439012", 200)
+        self.assertEqual(Leaderboard.objects.get(user_id="507f1f77bcf86cd799439012").rank, 1)
+        self.assertEqual(Leaderboard.objects.get(user_id="507f1f77bcf86cd799439011").rank, 2)
+
+    def test_delete_activity_reverts_totals(self):
+        self.post_activity("507f1f77bcf86cd799439011", 300)
+        response = self.post_activity("507f1f77bcf86cd799439012", 400)
+        self.client.delete(f"/api/activities/{response.data['_id']}/")
+        recompute.worker.drain()
+        entry = Leaderboard.objects.get(user_id="507f1f77bcf86cd799439012")
+        self.assertEqual(entry.total_calories, 0)
+        self.assertEqual(entry.rank, 2)
+
+
+@override_settings(OCTOFIT_LEADERBOARD_KEYFRAME_INTERVAL=3, OCTOFIT_LEADERBOARD_SNAPSHOT_CHUNK=2)
+class LeaderboardHistoryTest(APITestCase):
+    users = ["507f1f77bcf86cd799439011", "507f1f77bcf86cd799439012", "507f1f77bcf86cd799439013"]
+
+    def setUp(self):
+        self.client = APIClient()
+        leaderboard_history.invalidate()
+        leaderboard.apply_deltas({self.users[0]: [300, 30, 5.0], self.users[1]: [200, 20, 2.5]})
+        leaderboard_history.take_snapshot(datetime(2024, 1, 1, tzinfo=timezone.utc))
+        leaderboard.apply_deltas({self.users[1]: [150, 15, 1.25], self.users[2]: [50, 5, 0.5]})
+        leaderboard_history.take_snapshot(datetime(2024, 1, 2, tzinfo=timezone.utc))
+
+    def board(self, at):
+        taken_at, rows = leaderboard_history.board_at(at)
+        return [(row['user_id'], row['rank'], row['total_calories'], row['total_distance']) for row in rows]
+
+    def test_deltas_hold_only_changed_rows(self):
+        self.assertIsNone(leaderboard_history.take_snapshot(datetime(2024, 1, 3, tzinfo=timezone.utc)))
+        documents = list(get_db().leaderboard_snapshots.find({'seq': 1}))
+        self.assertFalse(documents[0]['keyframe'])
+        # users[0] only moved down a place, users[2] is new; all three changed.
+        self.assertEqual(sorted(user_id for document in documents for user_id in document['user_ids']), self.users)
+        leaderboard.apply_deltas({self.users[2]: [10, 0, 0]})
+        result = leaderboard_history.take_snapshot(datetime(2024, 1, 4, tzinfo=timezone.utc))
+        self.assertEqual((result['keyframe'], result['rows']), (False, 1))
+
+    def test_board_at(self):
+        leaderboard.apply_deltas({self.users[2]: [1000, 0, 0]})
+        self.assertFalse(leaderboard_history.take_snapshot(datetime(2024, 1, 5, tzinfo=timezone.utc))['keyframe'])
+        leaderboard.apply_deltas({self.users[0]: [10, 0, 0]})
+        self.assertTrue(leaderboard_history.take_snapshot(datetime(2024, 1, 6, tzinfo=timezone.utc))['keyframe'])
+        self.assertIsNone(leaderboard_history.board_at(datetime(2023, 12, 31, tzinfo=timezone.utc)))
+        self.assertEqual(self.board(datetime(2024, 1, 1, 12, tzinfo=timezone.utc)),
+                         [(self.users[0], 1, 300, 5.0), (self.users[1], 2, 200, 2.5)])
+        self.assertEqual(self.board(datetime(2024, 1, 4, tzinfo=timezone.utc)),
+                         [(self.users[1], 1, 350, 3.75), (self.users[0], 2, 300, 5.0), (self.users[2], 3, 50, 0.5)])
+        self.assertEqual(self.board(datetime(2024, 1, 5, 12, tzinfo=timezone.utc))[0], (self.users[2], 1, 1050, 0.5))
+        self.assertEqual([row[:3] for row in self.board(None)],
+                         [(self.users[2], 1, 1050), (self.users[1], 2, 350), (self.users[0], 3, 310)])
+
+    def test_replays_history_without_cached_board(self):
+        leaderboard_history.invalidate()
+        leaderboard.apply_deltas({self.users[0]: [1, 0, 0]})
+        leaderboard_history.take_snapshot(datetime(2024, 1, 3, tzinfo=timezone.utc))
+        self.assertEqual(self.board(None)[1], (self.users[0], 2, 301, 5.0))
+
+    def test_history_api(self):
+        response = self.client.get('/api/leaderboard/history/?at=2024-01-01T12:00:00Z&limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['taken_at'], datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual([row['user_id'] for row in response.data['results']], [self.users[0]])
+        response = self.client.get(f'/api/leaderboard/history/{self.users[0]}/')
+        self.assertEqual([(point['taken_at'].day, point['rank']) for point in response.data['results']],
+                         [(1, 1), (2, 2)])
+        response = self.client.get(f'/api/leaderboard/history/{self.users[2]}/?end=2024-01-01T12:00:00Z')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.client.get('/api/leaderboard/history/?at=2023-01-01T00:00:00Z').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/leaderboard/history/?at=yesterday').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class RankIndexTest(SimpleTestCase):
+    def test_matches_sorted_order(self):
+        index = RankIndex()
+        scores = {}
+        rng = random.Random(7)
+        for _ in range(2000):
+            member = f"user{rng.randrange(200)}"
+            if rng.random() < 0.1:
+                index.discard(member)
+                scores.pop(member, None)
+            else:
+                scores[member] = rng.randrange(50)
+                index.update(member, scores[member])
+        expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual([(m, s) for m, s, _ in index.range(0, len(index))], expected)
+        for position, (member, _) in enumerate(expected):
+            self.assertEqual(index.rank(member), position + 1)
+        self.assertEqual([r for _, _, r in index.range(10, 15)], [11, 12, 13, 14, 15])
+
+    def test_missing_member(self):
+        index = RankIndex()
+        self.assertIsNone(index.rank("nobody"))
+        self.assertEqual(index.range(0, 5), [])
+
+
+class FastListSerializerTest(SimpleTestCase):
+    def assertSameOutput(self, serializer_class, rows):
+        stock = JSONRenderer().render(ListSerializer(rows, child=serializer_class()).data)
+        fast = JSONRenderer().render(serializer_class(rows, many=True).data)
+        self.assertEqual(fast, stock)
+
+    def test_activities(self):
+        self.assertSameOutput(ActivitySerializer, [
+            Activity(_id=ObjectId(), user_id="507f1f77bcf86cd799439011", type="running", duration=30,
+                     distance=5, calories=300, date=datetime(2024, 1, 2, 3, 4, 5, 123000), notes="Run"),
+            Activity(_id=ObjectId(), user_id=ObjectId(), type="yoga", duration=45,
+                     distance=0.0, calories=150, date=datetime(2024, 1, 3), notes=""),
+        ])
+
+    def test_leaderboard(self):
+        self.assertSameOutput(LeaderboardSerializer, [
+            Leaderboard(_id=ObjectId(), user_id="507f1f77bcf86cd799439011", team="Team DC",
+                        total_calories=1000, total_duration=120, total_distance=10.123456789,
+                        rank=1, last_updated=datetime(2024, 5, 1, 12)),
+        ])
+
+    def test_users_teams_and_workouts(self):
+        self.assertSameOutput(UserSerializer, [
+            User(_id=ObjectId(), name="Hero", email="hero@test.com", password="secret",
+                 team="Team", created_at=datetime(2024, 1, 1)),
+        ])
+        self.assertSameOutput(TeamSerializer, [
+            Team(_id=ObjectId(), name="Team", description="Desc", members=[ObjectId()],
+                 created_at=datetime(2024, 1, 1)),
+        ])
+        self.assertSameOutput(WorkoutSerializer, [
+            Workout(_id=ObjectId(), name="Workout", type="gym", duration=60, difficulty="advanced",
+                    description="Desc", exercises=["squats", "pull-ups"]),
+        ])
+
+    def test_documents_match_instances(self):
+        document = {"_id": ObjectId(), "user_id": "507f1f77bcf86cd799439011", "type": "running",
+                    "duration": 30, "distance": 5, "calories": 300, "date": datetime(2024, 1, 2), "notes": "Run"}
+        from_document = ActivitySerializer([document], many=True).data
+        from_instance = ActivitySerializer([Activity(**document)], many=True).data
+        self.assertEqual(from_document, from_instance)
+
+
+class RendererTest(SimpleTestCase):
+    def assertSameJSON(self, data):
+        stock = JSONRenderer().render(data)
+        self.assertEqual(ORJSONRenderer().render(data), stock)
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data)), json.loads(stock))
+
+    def test_serializer_output(self):
+        self.assertSameJSON(ActivitySerializer([
+            Activity(_id=ObjectId(), user_id="507f1f77bcf86cd799439011", type="running", duration=30,
+                     distance=5.25, calories=300, date=datetime(2024, 1, 2, 3, 4, 5, 123000), notes="Ünïcode"),
+        ], many=True).data)
+
+    def test_python_values(self):
+        self.assertSameJSON({
+            'aware': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc),
+            'naive': datetime(2024, 1, 2),
+            'day': date(2024, 1, 2),
+            'decimal': Decimal('1.50'),
+            'numpy': [np.int64(3), np.float32(0.5), np.arange(2)],
+            'separators': 'line\u2028paragraph\u2029',
+        })
+        # orjson spells these differently (1e16 for 1e+16), but they parse to the same values.
+        floats = {'large': [1e16, -2.5e20], 'small': [1e-7, 1.5e-5, np.float64(3e-5)]}
+        self.assertEqual(json.loads(ORJSONRenderer().render(floats)), json.loads(JSONRenderer().render(floats)))
+
+    def test_non_finite_floats_are_rejected(self):
+        message = 'Out of range float values are not JSON compliant'
+        for distance in (float('nan'), float('inf')):
+            activity = Activity(_id=ObjectId(), user_id="507f1f77bcf86cd799439011", type="running", duration=30,
+                                distance=distance, calories=300, date=datetime(2024, 1, 2), notes="")
+            with self.assertRaisesMessage(ValueError, message):
+                ActivitySerializer([activity], many=True).data
+        for data in ([np.float32('nan')], {'nested': [1.0, {'inf': np.float64('-inf')}]}):
+            for renderer in (JSONRenderer(), ORJSONRenderer()):
+                with self.assertRaisesMessage(ValueError, message):
+                    renderer.render(data)
+        # Plain floats are not searched; orjson writes them as null.
+        self.assertEqual(ORJSONRenderer().render({'nan': float('nan'), 'missing': None}),
+                         b'{"nan":null,"missing":null}')
+
+    def test_object_ids(self):
+        object_id = ObjectId()
+        self.assertEqual(ORJSONRenderer().render({'_id': object_id}), f'{{"_id":"{object_id}"}}'.encode())
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render([object_id])), [str(object_id)])
+
+    def test_falls_back_to_stdlib(self):
+        for data, media_type in (({1: 'non-string key', 'big': 2 ** 70}, None),
+                                 ({'indented': [1, 2]}, 'application/json; indent=4')):
+            self.assertEqual(ORJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+    def test_msgpack_rejects_big_integers(self):
+        with self.assertRaisesMessage(OverflowError, 'does not fit in a 64-bit MessagePack integer'):
+            MessagePackRenderer().render({'big': 2 ** 70})
+        limits = [2 ** 64 - 1, -2 ** 63]
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(limits)), limits)
+
+    def test_parsers(self):
+        body = {'name': 'Run', 'tags': ['a', 'b'], 'distance': 5.5}
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(json.dumps(body).encode())), body)
+        self.assertEqual(MessagePackParser().parse(io.BytesIO(msgpack.packb(body))), body)
+        for parser, payload in ((ORJSONParser(), b'{"distance": NaN}'), (MessagePackParser(), b'\x93\x01')):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(payload))
+
+
+class DeclaredIndexesTest(SimpleTestCase):
+    def test_compound_indexes_declared(self):
+        names = {collection: [index.name for index in indexes]
+                 for collection, indexes in declared_indexes().items()}
+        self.assertIn('user_id_1_date_-1__id_-1', names['activities'])
+        self.assertIn('type_1_date_-1__id_-1', names['activities'])
+        self.assertIn('date_-1__id_-1', names['activities'])
+        self.assertIn('team_1_rank_1__id_1', names['leaderboard'])
+        self.assertIn('type_1_difficulty_1', names['workouts'])
+        self.assertIn('user_ids_1_seq_1', names['leaderboard_snapshots'])
+
+    def test_email_index_is_unique(self):
+        email_index, = [index for index in declared_indexes()['users'] if index.name == 'email_1']
+        self.assertTrue(email_index.unique)
+        self.assertIn('team_1', [index.name for index in declared_indexes()['users']])
+
+
+class LeaderboardRankAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        rank_index.invalidate()
+        for i in range(6):
+            self.client.post('/api/activities/', {
+                "user_id": f"507f1f77bcf86cd79943901{i}",
+                "type": "running",
+                "duration": 30,
+                "calories": 100 * (i + 1),
+                "date": datetime.now().isoformat(),
+            }, format='json')
+        recompute.worker.drain()
+
+    def test_top(self):
+        response = self.client.get('/api/leaderboard/top/?k=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['user_id'] for row in response.data],
+                         ["507f1f77bcf86cd799439015", "507f1f77bcf86cd799439014"])
+
+    def test_around(self):
+        response = self.client.get('/api/leaderboard/around/507f1f77bcf86cd799439012/?window=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['rank'] for row in response.data], [3, 4, 5])
+
+    def test_around_unknown_user(self):
+        response = self.client.get('/api/leaderboard/around/000000000000000000000000/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class NativeReadPathTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.activity = Activity.objects.create(
+            user_id="507f1f77bcf86cd799439011",
+            type="cycling",
+            duration=45,
+            distance=12.5,
+            calories=400,
+            date=datetime(2024, 3, 1, 8, 30),
+            notes="Morning ride"
+        )
+        self.user = User.objects.create(
+            name="Native User",
+            email="native@test.com",
+            password="secret",
+            team="Native Team"
+        )
+
+    def test_activity_retrieve_matches_serializer(self):
+        response = self.client.get(f'/api/activities/{self.activity._id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = ActivitySerializer(Activity.objects.get(_id=self.activity._id)).data
+        self.assertEqual(response.json(), dict(expected))
+
+    def test_user_list_matches_serializer(self):
+        response = self.client.get('/api/users/')
+        expected = UserSerializer(User.objects.get(_id=self.user._id)).data
+        self.assertIn(dict(expected), response.json()['results'])
+        self.assertNotIn('password', response.json()['results'][0])
+
+    def test_retrieve_unknown_id(self):
+        response = self.client.get('/api/activities/not-an-id/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sparse_fieldset(self):
+        response = self.client.get('/api/activities/?fields=type,duration,date')
+        self.assertEqual(response.json()['results'][0],
+                         {'type': 'cycling', 'duration': 45, 'date': '2024-03-01T08:30:00Z'})
+        response = self.client.get(f'/api/users/{self.user._id}/?fields=name')
+        self.assertEqual(response.json(), {'name': 'Native User'})
+
+    def test_unknown_or_write_only_field_rejected(self):
+        response = self.client.get('/api/users/?fields=name,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncReadPathTest(APITestCase):
+    def setUp(self):
+        for hour in range(3):
+            Activity.objects.create(user_id="507f1f77bcf86cd799439011", type="running", duration=30, distance=5.0,
+                                    calories=300, date=datetime(2024, 3, 1, hour), notes="")
+        self.user = User.objects.create(name="Async User", email="async@test.com", password="secret", team="Blue")
+
+    def get_async(self, path):
+        return async_to_sync(self.async_client.get)(path)
+
+    def test_activity_list_matches_sync_endpoint(self):
+        response = self.get_async('/api/async/activities/?page_size=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = self.client.get('/api/activities/?page_size=2').json()
+        self.assertEqual(response.json()['results'], expected['results'])
+        self.assertEqual(response.json()['next'].replace('/api/async/', '/api/'), expected['next'])
+
+    def test_user_retrieve_matches_sync_endpoint(self):
+        response = self.get_async(f'/api/async/users/{self.user._id}/')
+        self.assertEqual(response.json(), self.client.get(f'/api/users/{self.user._id}/').json())
+        self.assertEqual(self.get_async('/api/async/users/not-an-id/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkActivityAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.activity_data = {
+            "user_id": "507f1f77bcf86cd799439011",
+            "type": "running",
+            "duration": 30,
+            "calories": 300,
+            "date": datetime.now().isoformat(),
+        }
+
+    def test_bulk_create(self):
+        response = self.client.post('/api/activities/bulk/', [self.activity_data] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['status'] for item in response.data], [201, 201, 201])
+        self.assertEqual(Activity.objects.count(), 3)
+        recompute.worker.drain()
+        self.assertEqual(Leaderboard.objects.get(user_id="507f1f77bcf86cd799439011").total_calories, 900)
+
+    def test_bulk_reports_invalid_items(self):
+        invalid = dict(self.activity_data, duration="long")
+        response = self.client.post('/api/activities/bulk/', [self.activity_data, invalid], format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data[0]['status'], 201)
+        self.assertEqual(response.data[1]['status'], 400)
+        self.assertIn('duration', response.data[1]['errors'])
+
+    def test_bulk_requires_list(self):
+        response = self.client.post('/api/activities/bulk/', self.activity_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TeamLeaderboardAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for name, team, calories in (("A", "Red", 100), ("B", "Red", 150), ("C", "Blue", 400)):
+            user = User.objects.create(name=name, email=f"{name}@test.com", password="pw", team=team)
+            self.client.post('/api/activities/', {
+                "user_id": str(user._id),
+                "type": "running",
+                "duration": 30,
+                "calories": calories,
+                "date": datetime.now().isoformat(),
+            }, format='json')
+        recompute.worker.drain()
+
+    def test_team_standings(self):
+        response = self.client.get('/api/teams/leaderboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['team'], row['total_calories'], row['members']) for row in response.data],
+                         [("Blue", 400, 1), ("Red", 250, 2)])
+
+    def test_activity_write_invalidates_cache(self):
+        self.client.get('/api/teams/leaderboard/')
+        red_user = User.objects.get(name="A")
+        self.client.post('/api/activities/', {
+            "user_id": str(red_user._id),
+            "type": "running",
+            "duration": 30,
+            "calories": 500,
+            "date": datetime.now().isoformat(),
+        }, format='json')
+        recompute.worker.drain()
+        response = self.client.get('/api/teams/leaderboard/')
+        self.assertEqual(response.data[0]['team'], "Red")
+
+
+class LeaderboardStreamTest(SimpleTestCase):
+    def change(self, user_id, old_rank, new_rank, calories):
+        return {'user_id': user_id, 'old_rank': old_rank, 'new_rank': new_rank, 'total_calories': calories}
+
+    def test_changes_within_a_tick_are_coalesced(self):
+        async def scenario():
+            broadcaster = Broadcaster(tick=60, max_pending=10)
+            subscriber = broadcaster.subscribe()
+            pending = {}
+            for change in (self.change('a', 3, 2, 100), self.change('b', 2, 3, 90), self.change('a', 2, 1, 150)):
+                leaderboard_stream._merge(pending, change)
+            broadcaster._deliver(pending, False)
+            message = await broadcaster.next_message(subscriber, timeout=1)
+            broadcaster.unsubscribe(subscriber)
+            return message
+
+        message = asyncio.run(scenario())
+        self.assertEqual(message['tick'], 1)
+        self.assertEqual(message['changes'], [self.change('a', 3, 1, 150), self.change('b', 2, 3, 90)])
+
+    def test_slow_subscriber_is_reset(self):
+        async def scenario():
+            broadcaster = Broadcaster(tick=60, max_pending=1)
+            subscriber = broadcaster.subscribe()
+            broadcaster._deliver({'a': self.change('a', 1, 1, 10)}, False)
+            broadcaster._deliver({'b': self.change('b', 2, 2, 5)}, False)
+            message = await broadcaster.next_message(subscriber, timeout=1)
+            idle = await broadcaster.next_message(subscriber, timeout=0.01)
+            broadcaster.unsubscribe(subscriber)
+            return message, idle
+
+        self.assertEqual(asyncio.run(scenario()), ({'reset': True}, None))
+
+    def test_tick_does_not_load_the_rank_index(self):
+        async def scenario():
+            broadcaster = Broadcaster(tick=60, max_pending=10)
+            subscriber = broadcaster.subscribe()
+            broadcaster.publish([self.change('a', 3, 2, 100)])
+            with mock.patch.object(rank_index, '_load', side_effect=AssertionError('loaded on the tick')):
+                rank_index.invalidate()
+                self.assertTrue(broadcaster._flush())
+            message = await broadcaster.next_message(subscriber, timeout=1)
+            broadcaster.unsubscribe(subscriber)
+            return message
+
+        self.assertEqual(asyncio.run(scenario())['changes'], [self.change('a', 3, 2, 100)])
+
+
+class RecomputeWorkerTest(SimpleTestCase):
+    def test_burst_is_debounced_into_one_batch(self):
+        batches = []
+        worker = RecomputeWorker(lambda changes, user_ids: batches.append((len(changes), user_ids)),
+                                 debounce=0.05, max_delay=5)
+        for user_id in ('a', 'b', 'a'):
+            worker.submit(added=[{'user_id': user_id}])
+        self.assertEqual(worker.depth(), 2)
+        self.assertGreaterEqual(worker.lag(), 0)
+        self.assertTrue(worker.drain(timeout=5))
+        self.assertEqual(batches, [(3, {'a', 'b'})])
+        self.assertEqual((worker.depth(), worker.lag()), (0, 0.0))
+
+    def test_failed_batch_does_not_stop_the_worker(self):
+        def process(changes, user_ids):
+            if 'bad' in user_ids:
+                raise RuntimeError('boom')
+            processed.update(user_ids)
+
+        processed = set()
+        worker = RecomputeWorker(process, debounce=0, max_delay=0)
+        with self.assertLogs('octofit_tracker.recompute', 'ERROR'):
+            worker.submit(removed=[{'user_id': 'bad'}])
+            worker.drain(timeout=5)
+        worker.submit(added=[{'user_id': 'good'}])
+        worker.drain(timeout=5)
+        self.assertEqual(processed, {'good'})
+
+    def test_queue_gauges_are_exported(self):
+        self.assertIn('octofit_recompute_queue_depth ', exposition())
+        self.assertIn('octofit_recompute_queue_lag_seconds ', exposition())
+
+
+class TeamFeedBufferTest(SimpleTestCase):
+    def test_pages_newest_first_and_evicts_oldest(self):
+        feed = TeamFeed(3)
+        for number in range(5):
+            feed.push(str(number), {'n': number})
+        self.assertEqual(len(feed), 3)
+        self.assertEqual([event['n'] for _, event in feed.page(2)], [4, 3, 2])
+        self.assertEqual([event['n'] for _, event in feed.page(2, before='3')], [2])
+        with self.assertRaises(KeyError):
+            feed.page(2, before='0')
+
+    def test_replace_keeps_position_and_remove_skips(self):
+        feed = TeamFeed(4)
+        for number in range(3):
+            feed.push(str(number), {'n': number})
+        feed.replace('1', {'n': 10})
+        feed.remove('2')
+        self.assertEqual([event['n'] for _, event in feed.page(5)], [10, 0])
+
+    def test_write_during_load_is_replayed(self):
+        team_feed.invalidate()
+        activity = {'_id': ObjectId(), 'user_id': '507f1f77bcf86cd799439011', 'type': 'running', 'duration': 30,
+                    'distance': 5.0, 'calories': 300, 'date': datetime(2024, 3, 1), 'notes': ''}
+
+        def load(team):
+            # The feed is read from MongoDB outside the lock; a write lands meanwhile.
+            team_feed.activities_changed([activity], [], {activity['user_id']: team})
+            return TeamFeed(5)
+
+        with mock.patch.object(team_feed, '_load', load):
+            entries = team_feed.page('Red', 10)
+        team_feed.invalidate()
+        self.assertEqual([activity_id for activity_id, _ in entries], [str(activity['_id'])])
+
+
+class TeamFeedAPITest(APITestCase):
+    def setUp(self):
+        team_feed.invalidate()
+        self.team = Team.objects.create(name="Feed Team", description="", members=[])
+        member = User.objects.create(name="Member", email="member@test.com", password="x", team="Feed Team")
+        outsider = User.objects.create(name="Outsider", email="outsider@test.com", password="x", team="Other")
+        for user, hour in ((member, 1), (outsider, 2), (member, 3)):
+            self.client.post('/api/activities/', {
+                "user_id": str(user._id), "type": "running", "duration": 30 + hour, "distance": 5.0,
+                "calories": 300, "date": datetime(2024, 3, 1, hour).isoformat(),
+            }, format='json')
+        recompute.worker.drain()
+
+    def test_feed_pages_team_activities_newest_first(self):
+        response = self.client.get(f'/api/teams/{self.team._id}/feed/?page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['duration'] for item in response.json()['results']], [33])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([item['duration'] for item in response.json()['results']], [31])
+        self.assertIsNone(response.json()['next'])
+
+    def test_feed_sees_new_activity_after_load(self):
+        self.client.get(f'/api/teams/{self.team._id}/feed/')
+        member = User.objects.get(email="member@test.com")
+        self.client.post('/api/activities/', {
+            "user_id": str(member._id), "type": "yoga", "duration": 50, "distance": 0,
+            "calories": 100, "date": datetime(2024, 1, 1).isoformat(),
+        }, format='json')
+        recompute.worker.drain()
+        response = self.client.get(f'/api/teams/{self.team._id}/feed/')
+        self.assertEqual(response.json()['results'][0]['duration'], 50)
+
+
+class QueryFilterTest(APITestCase):
+    samples = {
+        'user_id': '507f1f77bcf86cd799439011',
+        'type': 'running',
+        'date_after': '2024-01-02T00:00:00Z',
+        'date_before': '2024-01-04T00:00:00Z',
+        'min_duration': '40',
+        'min_calories': '350',
+        'team': 'Filter Team',
+        'rank_min': '2',
+        'rank_max': '3',
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        for day in range(4):
+            Activity.objects.create(
+                user_id="507f1f77bcf86cd799439011" if day % 2 else "507f1f77bcf86cd799439012",
+                type="running" if day < 2 else "cycling",
+                duration=30 + day * 10,
+                distance=5.0,
+                calories=300 + day * 50,
+                date=datetime(2024, 1, day + 1),
+                notes=""
+            )
+            Leaderboard.objects.create(
+                user_id=f"507f1f77bcf86cd79943902{day}",
+                team="Filter Team" if day % 2 else "Other Team",
+                total_calories=1000 - day,
+                total_duration=60,
+                total_distance=10.0,
+                rank=day + 1
+            )
+        ensure_indexes()
+
+    def test_activity_filters(self):
+        response = self.client.get('/api/activities/?type=running&min_calories=350')
+        self.assertEqual([row['duration'] for row in response.data['results']], [40])
+        response = self.client.get('/api/activities/?date_after=2024-01-02T00:00:00Z&date_before=2024-01-04T00:00:00Z')
+        self.assertEqual([row['duration'] for row in response.data['results']], [50, 40])
+
+    def test_leaderboard_filters(self):
+        response = self.client.get('/api/leaderboard/?team=Filter Team&rank_min=3')
+        self.assertEqual([row['rank'] for row in response.data['results']], [4])
+
+    def test_invalid_value_rejected(self):
+        response = self.client.get('/api/activities/?min_duration=long')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_no_filter_combination_scans_the_collection(self):
+        for viewset in (ActivityViewSet, LeaderboardViewSet):
+            collection = get_db()[viewset.repository.collection]
+            sort = [(name.lstrip('-'), -1 if name.startswith('-') else 1) for name in viewset.keyset_ordering]
+            params = list(dict.fromkeys(query_filter.param for query_filter in viewset.query_filters))
+            # Fields some declared index starts with; the others can only be filtered after the scan.
+            leading = {index.keys[0][0] for index in declared_indexes()[collection.name]}
+            for size in range(len(params) + 1):
+                for combination in itertools.combinations(params, size):
+                    query = compile_filters(viewset.query_filters, {param: self.samples[param] for param in combination},
+                                            viewset.queryset.model)
+                    plan = collection.find(query).sort(sort).limit(51).explain()['queryPlanner']['winningPlan']
+                    indexed = {query_filter.field for query_filter in viewset.query_filters
+                               if query_filter.param in combination} & leading
+                    with self.subTest(collection=collection.name, filters=combination):
+                        self.assertNotIn('COLLSCAN', _plan_stages(plan))
+                        if indexed:
+                            # A full-range IXSCAN would pass the check above without the filter using the index.
+                            self.assertTrue(_bounded_fields(plan) & indexed, plan)
+
+
+def _plan_stages(plan):
+    """
+    Every stage name in an explain() plan tree
+    """
+    if isinstance(plan, list):
+        return [stage for child in plan for stage in _plan_stages(child)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan['stage']] if 'stage' in plan else []
+    return stages + [stage for value in plan.values() for stage in _plan_stages(value)]
+
+
+def _bounded_fields(plan):
+    """
+    Fields whose index bounds in an explain() plan tree are narrower than [MinKey, MaxKey]
+    """
+    if isinstance(plan, list):
+        return {field for child in plan for field in _bounded_fields(child)}
+    if not isinstance(plan, dict):
+        return set()
+    fields = {field for field, bounds in plan.get('indexBounds', {}).items()
+              if bounds not in (['[MinKey, MaxKey]'], ['[MaxKey, MinKey]'])}
+    return fields.union(*(_bounded_fields(value) for value in plan.values()))
+
+
+class ActivityRollupAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Rollup Hero",
+            email="rollup@test.com",
+            password="test_password",
+            team="Rollup Team"
+        )
+        for day, calories in ((1, 100), (1, 200), (2, 50)):
+            self.client.post('/api/activities/', {
+                "user_id": str(self.user._id),
+                "type": "running",
+                "duration": 30,
+                "calories": calories,
+                "date": datetime(2024, 5, day, 12).isoformat(),
+            }, format='json')
+        recompute.worker.drain()
+
+    def test_user_daily_rollup(self):
+        response = self.client.get(f'/api/stats/?scope=user&key={self.user._id}&period=day')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['bucket'], row['calories'], row['count']) for row in response.data],
+                         [('2024-05-01', 300, 2), ('2024-05-02', 50, 1)])
+
+    def test_team_weekly_rollup(self):
+        response = self.client.get('/api/stats/?scope=team&key=Rollup Team&period=week')
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['calories'], 350)
+        self.assertEqual(response.data[0]['by_type']['running']['count'], 3)
+
+    def test_invalid_period(self):
+        response = self.client.get('/api/stats/?period=month')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityExportTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for day in range(3):
+            Activity.objects.create(
+                user_id="507f1f77bcf86cd799439011",
+                type="running",
+                duration=30,
+                distance=5.0,
+                calories=300,
+                date=datetime(2024, 2, day + 1),
+                notes="Export, with comma"
+            )
+
+    def test_ndjson_export(self):
+        response = self.client.get('/api/activities/export/?format=ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['date'], '2024-02-01T00:00:00Z')
+
+    def test_csv_export_with_date_range(self):
+        response = self.client.get('/api/activities/export/?format=csv&start=2024-02-02T00:00:00')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['notes'], 'Export, with comma')
+
+
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for day in range(5):
+            Activity.objects.create(
+                user_id="507f1f77bcf86cd799439011",
+                type="running",
+                duration=30,
+                distance=5.0,
+                calories=300,
+                date=datetime(2024, 1, day + 1),
+                notes=""
+            )
+
+    def test_walks_all_pages_newest_first(self):
+        response = self.client.get('/api/activities/?page_size=2')
+        dates = []
+        pages = 0
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            dates.extend(row['date'] for row in response.data['results'])
+            pages += 1
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(dates), 5)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class WorkoutMatrixTest(SimpleTestCase):
+    def workout(self, name, workout_type, duration, difficulty):
+        return {'_id': ObjectId(), 'name': name, 'type': workout_type, 'duration': duration,
+                'difficulty': difficulty, 'description': '', 'exercises': []}
+
+    def test_scores_match_the_activity_mix(self):
+        matrix = WorkoutMatrix([
+            self.workout('Yoga', 'yoga', 45, 'beginner'),
+            self.workout('Tempo', 'running', 30, 'advanced'),
+            self.workout('Ride', 'cycling', 90, 'intermediate'),
+        ])
+        activities = [{'type': 'running', 'duration': 30, 'calories': 330}] * 3 + \
+            [{'type': 'yoga', 'duration': 45, 'calories': 135}]
+        ranked = [(matrix.workouts[row]['name'], round(score, 2))
+                  for row, score in matrix.top(matrix.user_vector(activities), 2)]
+        # Tempo: 3/4 of the type, duration and intensity mass; Yoga: 1/4 of each.
+        self.assertEqual(ranked, [('Tempo', 0.75), ('Yoga', 0.25)])
+
+    def test_no_history_or_workouts(self):
+        matrix = WorkoutMatrix([self.workout('Yoga', 'yoga', 45, 'beginner')])
+        self.assertEqual(matrix.top(matrix.user_vector([]), 5), [(0, 0.0)])
+        self.assertEqual(WorkoutMatrix([]).top(WorkoutMatrix([]).user_vector([]), 5), [])
+
+
+class RecommendationAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        recommendations.workout_matrix.invalidate()
+        self.user = User.objects.create(name="Runner", email="runner@test.com", password="x", team="Red")
+        Workout.objects.create(name="Yoga Flow", type="yoga", duration=45, difficulty="beginner",
+                               description="", exercises=[])
+        Workout.objects.create(name="Tempo Run", type="running", duration=30, difficulty="advanced",
+                               description="", exercises=[])
+        for day in range(3):
+            Activity.objects.create(user_id=str(self.user._id), type="running", duration=30, distance=5.0,
+                                    calories=330, date=datetime(2024, 1, day + 1), notes="")
+
+    def test_recommends_matching_workout_first(self):
+        response = self.client.get(f'/api/users/{self.user._id}/recommendations/?limit=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['based_on'], 3)
+        self.assertEqual([row['name'] for row in response.data['results']], ["Tempo Run"])
+        self.assertEqual(response.data['results'][0]['score'], 1.0)
+
+    def test_new_workout_is_scored(self):
+        self.client.get(f'/api/users/{self.user._id}/recommendations/')
+        created = self.client.post('/api/workouts/', {"name": "Easy Jog", "type": "running", "duration": 25,
+                                                      "difficulty": "advanced", "description": "Slow and steady",
+                                                      "exercises": ["jogging"]}, format='json')
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(f'/api/users/{self.user._id}/recommendations/')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_unknown_user(self):
+        response = self.client.get('/api/users/000000000000000000000000/recommendations/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AnalyticsTest(SimpleTestCase):
+    def columns(self, rows):
+        dates, durations, distances, calories = zip(*rows)
+        return {
+            'dates': np.array(dates, dtype='datetime64[s]'),
+            'durations': np.array(durations, dtype=np.int64),
+            'distances': np.array(distances, dtype=np.float64),
+            'calories': np.array(calories, dtype=np.int64),
+        }
+
+    def test_streaks_weeks_and_bests(self):
+        stats = analytics.compute(self.columns([
+            ('2024-01-01T07:00', 30, 5.0, 300),
+            ('2024-01-02T07:00', 40, 8.0, 400),
+            ('2024-01-03T07:00', 30, 0.0, 150),
+            ('2024-01-05T07:00', 60, 10.0, 600),
+            ('2024-01-08T07:00', 45, 9.0, 500),
+        ]))
+        self.assertEqual(stats['streaks'], {'longest': 3, 'active_days': 5})
+        self.assertEqual(stats['_last_run'], (1, date(2024, 1, 8)))
+        self.assertEqual([(week['week'], week['calories'], week['calories_avg']) for week in stats['weekly']],
+                         [('2024-W01', 1450, 1450.0), ('2024-W02', 500, 975.0)])
+        self.assertEqual(stats['personal_bests']['calories'], {'value': 600, 'date': '2024-01-05T07:00:00Z'})
+        # 40 minutes over 8 km; the activity without a distance has no pace.
+        self.assertEqual(stats['personal_bests']['pace'], {'value': 5.0, 'date': '2024-01-02T07:00:00Z'})
+        self.assertEqual(stats['personal_bests']['week'], {'calories': 1450, 'week': '2024-W01'})
+        # 175 minutes over the 32 km of the activities with a distance.
+        self.assertEqual(stats['metrics'], {'pace': 5.47, 'calories_per_activity': 390.0})
+
+    def test_no_activities(self):
+        stats = analytics.compute({name: np.array([]) for name in ('dates', 'durations', 'distances', 'calories')})
+        self.assertEqual(stats['activities'], 0)
+        self.assertEqual(stats['weekly'], [])
+
+    def test_percentile_rank(self):
+        values = np.array([1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(analytics.percentile_rank(values, 3.0), 62.5)
+        self.assertEqual(analytics.percentile_rank(values, 3.0, higher_is_better=False), 37.5)
+        self.assertIsNone(analytics.percentile_rank(values, None))
+        self.assertIsNone(analytics.percentile_rank(np.array([]), 3.0))
+
+
+class UserStatsAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        analytics.invalidate()
+        self.user = User.objects.create(name="Runner", email="runner@test.com", password="x", team="Red")
+        other = User.objects.create(name="Walker", email="walker@test.com", password="x", team="Red")
+        for day in range(3):
+            Activity.objects.create(user_id=str(self.user._id), type="running", duration=30, distance=6.0,
+                                    calories=300, date=datetime(2024, 1, day + 1), notes="")
+        Activity.objects.create(user_id=str(other._id), type="walking", duration=60, distance=5.0,
+                                calories=200, date=datetime(2024, 1, 1), notes="")
+        recompute.worker.drain()
+
+    def test_stats(self):
+        response = self.client.get(f'/api/users/{self.user._id}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['activities'], 3)
+        self.assertEqual(response.data['totals'], {'calories': 900, 'duration': 90, 'distance': 18.0})
+        self.assertEqual(response.data['streaks'], {'longest': 3, 'active_days': 3, 'current': 0})
+        self.assertEqual(response.data['team'], {'name': 'Red', 'pace_percentile': 75.0,
+                                                 'calories_percentile': 75.0})
+
+    def test_new_activity_is_counted(self):
+        self.client.get(f'/api/users/{self.user._id}/stats/')
+        Activity.objects.create(user_id=str(self.user._id), type="running", duration=60, distance=10.0,
+                                calories=900, date=datetime(2024, 1, 4), notes="")
+        response = self.client.get(f'/api/users/{self.user._id}/stats/')
+        self.assertEqual(response.data['activities'], 4)
+        self.assertEqual(response.data['streaks']['longest'], 4)
+
+    @override_settings(OCTOFIT_USER_STATS_TEAM_CACHE_SIZE=2)
+    def test_team_cache_is_bounded(self):
+        for team in ('Red', 'Blue', 'Green', 'Blue'):
+            analytics.team_metrics(team)
+        self.assertEqual(list(analytics._teams), ['Green', 'Blue'])
+
+    def test_unknown_user(self):
+        response = self.client.get('/api/users/000000000000000000000000/stats/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class WorkoutAPITest(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -208,6 +1157,185 @@ class WorkoutAPITest(APITestCase):
         response = self.client.get('/api/workouts/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_sparse_fieldset(self):
+        Workout.objects.create(**self.workout_data)
+        response = self.client.get('/api/workouts/?fields=name,difficulty')
+        self.assertEqual(response.data['results'][0], {'name': 'API Test Workout', 'difficulty': 'intermediate'})
+
+    def test_msgpack(self):
+        response = self.client.post('/api/workouts/', self.workout_data, format='msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['name'], "API Test Workout")
+        response = self.client.get('/api/workouts/?format=msgpack')
+        as_json = self.client.get('/api/workouts/')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(as_json.content))
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        response_cache.bump('workouts')
+        self.workout_data = {
+            "name": "Cached Workout",
+            "type": "gym",
+            "duration": 60,
+            "difficulty": "intermediate",
+            "description": "Test workout",
+            "exercises": ["push-ups"]
+        }
+        self.client.post('/api/workouts/', self.workout_data, format='json')
+
+    def test_conditional_get_returns_not_modified(self):
+        first = self.client.get('/api/workouts/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+        hits = response_cache.hits
+        second = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response_cache.hits, hits + 1)
+
+    def test_write_invalidates_cached_list(self):
+        first = self.client.get('/api/workouts/')
+        self.client.post('/api/workouts/', dict(self.workout_data, name="Another Workout"), format='json')
+        second = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_representations_have_their_own_etag(self):
+        as_json = self.client.get('/api/workouts/')
+        as_msgpack = self.client.get('/api/workouts/?format=msgpack')
+        self.assertNotEqual(as_msgpack['ETag'], as_json['ETag'])
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+        self.assertIn('Accept', as_json['Vary'])
+        second = self.client.get('/api/workouts/?format=msgpack', HTTP_IF_NONE_MATCH=as_json['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+
+    def test_stats_endpoint(self):
+        self.client.get('/api/workouts/')
+        response = self.client.get('/api/cache/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hits', response.data)
+        self.assertIn('misses', response.data)
+
+
+class SyntheticPopulateTest(TestCase):
+    def populate(self):
+        call_command('populate_db', users=20, teams=3, activities_per_user=4, seed=5, workers=1,
+                     end_date=date(2024, 5, 1), stdout=io.StringIO())
+        return sorted((row.user_id, row.total_calories) for row in Leaderboard.objects.all())
+
+    def test_generates_requested_volume_deterministically(self):
+        first = self.populate()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertEqual(self.populate(), first)
+
+    def test_ranks_follow_totals(self):
+        self.populate()
+        totals = [row.total_calories for row in Leaderboard.objects.order_by('rank')]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+
+class ImportActivitiesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name='Tony Stark', email='tony@avengers.com', team='marvel')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'activities.csv')
+        with open(self.path, 'w') as handle:
+            handle.write('email,type,duration,distance,calories,date,notes\n'
+                         'TONY@avengers.com,running,30,5.0,300,2024-05-01T10:00:00Z,"two\nlines"\n'
+                         'nobody@avengers.com,yoga,20,,100,2024-05-02T10:00:00Z,\n'
+                         'tony@avengers.com,cycling,forty,,500,2024-05-03T10:00:00Z,\n'
+                         'tony@avengers.com,cycling,40,12,500,2024-05-03T10:00:00Z,\n')
+
+    def run_import(self, **options):
+        call_command('import_activities', self.path, batch_size=2, stdout=io.StringIO(), stderr=io.StringIO(),
+                     **options)
+
+    def test_imports_valid_rows_and_settles_derived_data(self):
+        self.run_import()
+        self.assertEqual(Activity.objects.count(), 2)
+        row = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual((row.total_calories, row.rank), (800, 1))
+        self.assertEqual(ActivityRollup.objects.filter(scope='team', key='marvel', period='week').count(), 2)
+
+    def test_reimport_skips_existing_rows(self):
+        self.run_import()
+        self.run_import()
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 800)
+
+    def test_resume_settles_users_from_earlier_batches(self):
+        import_batch = ImportCommand.import_batch
+        calls = []
+
+        def interrupted(command, *args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return import_batch(command, *args)
+
+        with mock.patch.object(ImportCommand, 'import_batch', interrupted), self.assertRaises(KeyboardInterrupt):
+            self.run_import()
+        self.run_import(resume=True)
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 800)
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint.users'))
+
+
+class ImportValidationTest(SimpleTestCase):
+    user_id = '507f1f77bcf86cd799439011'
+
+    def test_non_string_date_rejects_the_row(self):
+        columns = [(field.name, field) for field in Activity._meta.concrete_fields
+                   if not field.primary_key and field.name != 'user_id']
+        rows = [({'user_id': self.user_id, 'type': 'running', 'duration': 30, 'calories': 300, 'date': date}, None)
+                for date in (1709251200, '2024-03-01T00:00:00Z')]
+        documents, errors = ImportCommand().validate(rows, columns, {}, {self.user_id: 'marvel'})
+        self.assertEqual(list(errors[0]), ['date'])
+        self.assertIn('1709251200', errors[0]['date'][0])
+        self.assertEqual((errors[1], documents[1]['date']), ({}, datetime(2024, 3, 1, tzinfo=timezone.utc)))
+
+    def test_checkpoint_appends_only_new_users(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        checkpoint_path = os.path.join(directory.name, 'activities.checkpoint')
+        state = {'source': 'activities.csv', 'offset': 10, 'rows': 1, 'inserted': 1, 'duplicates': 0, 'rejected': 0}
+        with open(f'{checkpoint_path}.users', 'w') as users:
+            ImportCommand().save_checkpoint(checkpoint_path, state, users, {'b', 'a'})
+            ImportCommand().save_checkpoint(checkpoint_path, dict(state, offset=20), users, {'c'})
+        with open(checkpoint_path) as checkpoint:
+            self.assertEqual(json.load(checkpoint), dict(state, offset=20))
+        with open(f'{checkpoint_path}.users') as users:
+            self.assertEqual(users.read().split(), ['a', 'b', 'c'])
+
+
+class MetricsTest(APITestCase):
+    def test_histogram_exposition_is_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', ('view',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(('a',), value)
+        lines = histogram.expose()
+        self.assertIn('test_seconds_bucket{view="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{view="a"} 3', lines)
+
+    def test_metrics_endpoint_reports_requests_by_view(self):
+        self.client.get('/api/activities/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('octofit_http_request_duration_seconds_count{view="activity-list",method="GET",status="200"}',
+                      body)
+        self.assertIn('octofit_http_request_phase_seconds_count{view="activity-list",phase="mongo"}', body)
+        self.assertIn('octofit_mongo_command_duration_seconds_count{command="find"}', body)
+
 
 class APIRootTest(APITestCase):
     def test_api_root(self):
@@ -218,3 +1346,4 @@ class APIRootTest(APITestCase):
         self.assertIn('activities', response.data)
         self.assertIn('leaderboard', response.data)
         self.assertIn('workouts', response.data)
+        self.assertIn('stats', response.data)
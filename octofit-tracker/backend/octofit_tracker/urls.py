@@ -17,8 +17,12 @@ import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
+from .metrics import metrics
 from .views import (
     api_root,
+    cache_stats,
+    stats,
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
@@ -40,5 +44,12 @@ router.register(r'workouts', WorkoutViewSet, basename='workout')
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
+    path('metrics', metrics, name='metrics'),
+    path('api/stats/', stats, name='stats'),
+    path('api/cache/', cache_stats, name='cache-stats'),
+    # Async versions of the hottest reads for ASGI deployments; pymongo runs on the mongo.run_async executor
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/users/<str:pk>/', async_views.user_detail, name='async-user-detail'),
     path('api/', include(router.urls)),
 ]
@@ -1,8 +1,29 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from rest_framework import status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
+from . import (
+    activity_hooks, analytics, leaderboard, leaderboard_history, leaderboard_stream, rank_index, recommendations,
+    rollups, team_feed
+)
 from .models import User, Team, Activity, Leaderboard, Workout
+from .caching import response_cache
+from .filters import QueryFilter, compile_filters
+from .mongo import as_document, get_db
+from .renderers import CSVRenderer, NDJSONRenderer
+from .repository import Repository
 from .serializers import (
     UserSerializer,
     TeamSerializer,
@@ -22,44 +43,479 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'stats': reverse('stats', request=request, format=format),
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def stats(request, format=None):
+    """
+    Activity rollups per day or ISO week.
+
+    ?scope=user|team (default user), ?key=<user_id or team name>,
+    ?period=day|week (default day), ?start= / ?end= bucket labels, ?type=
+    """
+    params = request.query_params
+    scope = params.get('scope', 'user')
+    period = params.get('period', 'day')
+    if scope not in ('user', 'team') or period not in ('day', 'week'):
+        return Response({'detail': 'scope must be user or team; period must be day or week.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response(rollups.query(
+        scope, period,
+        key=params.get('key'),
+        start=params.get('start'),
+        end=params.get('end'),
+        activity_type=params.get('type'),
+    ))
+
+
+@api_view(['GET'])
+def cache_stats(request, format=None):
+    """
+    Hit/miss counters of the response cache
+    """
+    return Response(response_cache.stats())
+
+
+def requested_fields(request, serializer_class):
+    """
+    The readable serializer fields named in ?fields=a,b (in declared order), or None for all
+    """
+    raw = request.query_params.get('fields')
+    if not raw or request.method not in SAFE_METHODS:
+        return None
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    readable = _readable_fields(serializer_class)
+    unknown = names.difference(readable)
+    if unknown:
+        raise ValidationError({'fields': [f'Unknown field: {name}' for name in sorted(unknown)]})
+    return tuple(name for name in readable if name in names) or None
+
+
+@lru_cache(maxsize=None)
+def _readable_fields(serializer_class):
+    return tuple(name for name, field in serializer_class().fields.items() if not field.write_only)
+
+
+class SparseFieldsViewMixin:
+    """
+    Trim read responses to ?fields=a,b; querysets only load those columns
+    """
+
+    def get_requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = requested_fields(self.request, self.get_serializer_class())
+        return self._requested_fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*fields, *(name.lstrip('-') for name in getattr(self, 'keyset_ordering', ())))
+        return queryset
+
+
+class NativeReadMixin:
+    """
+    Serve list and retrieve from MongoDB through `repository`, skipping djongo;
+    lists are filtered by the viewset's `query_filters`
+    """
+    repository = None
+    query_filters = ()
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_requested_fields()
+        query = compile_filters(self.query_filters, request.query_params, self.queryset.model)
+        if self.paginator is None:
+            documents = self.repository.find(query, fields=fields)
+            return Response(self.repository.to_wire_list(documents, fields))
+        documents = self.paginator.paginate_repository(self.repository, request, self, filter=query, fields=fields)
+        return self.get_paginated_response(self.repository.to_wire_list(documents, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        fields = self.get_requested_fields()
+        document = self.repository.get(kwargs[self.lookup_url_kwarg or self.lookup_field], fields)
+        if document is None:
+            raise Http404
+        return Response(self.repository.to_wire_list([document], fields)[0])
+
+
+class CachedResponseMixin:
+    """
+    Serve list and retrieve through response_cache with ETag/Last-Modified
+    revalidation; writes through the viewset invalidate the collection
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(super().retrieve, request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        response_cache.bump(self._cache_collection())
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        response_cache.bump(self._cache_collection())
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        response_cache.bump(self._cache_collection())
+
+    def _cache_collection(self):
+        return self.queryset.model._meta.db_table
+
+    def _cached_response(self, handler, request, *args, **kwargs):
+        collection = self._cache_collection()
+        query = tuple((name, tuple(values)) for name, values in sorted(request.query_params.lists()))
+        media_type = request.accepted_media_type
+        key = (request.get_host(), request.path, query, media_type)
+        entry = response_cache.get(collection, key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = response_cache.put(collection, key, response.data, media_type)
+
+        if _not_modified(request, entry):
+            response_cache.record_not_modified()
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+def _not_modified(request, entry):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or entry['etag'] in tags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(entry['last_modified']) <= if_modified_since
+
+
+class UserViewSet(SparseFieldsViewMixin, NativeReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for users
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    repository = Repository('users', UserSerializer)
+    keyset_ordering = ('email',)
+
+    @action(detail=True)
+    def recommendations(self, request, pk=None):
+        """
+        Workouts best matching the user's recent activity mix (?limit=)
+        """
+        if self.repository.get(pk, fields=('_id',)) is None:
+            raise Http404
+        return Response(recommendations.recommend(pk, limit=_int_param(request, 'limit', 10, maximum=50)))
+
+    @action(detail=True)
+    def stats(self, request, pk=None):
+        """
+        Streaks, weekly moving averages, personal bests and percentiles within the user's team
+        """
+        user = self.repository.get(pk, fields=('team',))
+        if user is None:
+            raise Http404
+        return Response(analytics.user_stats(str(user['_id']), user.get('team')))
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(CachedResponseMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for teams
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    keyset_ordering = ('name', '_id')
+
+    @action(detail=False)
+    def leaderboard(self, request):
+        """
+        Team standings, aggregated in MongoDB and cached between writes
+        """
+        return Response(leaderboard.team_standings_cache.get())
+
+    @action(detail=True)
+    def feed(self, request, pk=None):
+        """
+        The team's most recent activities, newest first (?page_size=, ?cursor=, ?fields=)
+        """
+        team = get_db().teams.find_one({'_id': ObjectId(pk)}, {'name': 1}) if ObjectId.is_valid(pk) else None
+        if team is None:
+            raise Http404
+        paginator = self.paginator
+        limit = paginator.get_page_size(request)
+        try:
+            entries = team_feed.page(team['name'], limit, before=request.query_params.get('cursor') or None)
+        except KeyError:
+            raise NotFound(paginator.invalid_cursor_message)
+        next_link = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_link = replace_query_param(request.build_absolute_uri(), 'cursor', entries[-1][0])
+        fields = requested_fields(request, ActivitySerializer)
+        results = [event if fields is None else {name: event[name] for name in fields} for _, event in entries]
+        return Response({'next': next_link, 'results': results})
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(SparseFieldsViewMixin, NativeReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for activities
+
+    Lists filter on ?user_id=, ?type=, ?date_after= / ?date_before=, ?min_duration= and ?min_calories=
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    repository = Repository('activities', ActivitySerializer)
+    keyset_ordering = ('-date', '-_id')
+    query_filters = (
+        QueryFilter('user_id'),
+        QueryFilter('type'),
+        QueryFilter('date', 'date_after', '$gte'),
+        QueryFilter('date', 'date_before', '$lt'),
+        QueryFilter('duration', 'min_duration', '$gte'),
+        QueryFilter('calories', 'min_calories', '$gte'),
+    )
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        activity_hooks.activities_changed(added=[as_document(activity)])
+
+    def perform_update(self, serializer):
+        before = as_document(serializer.instance)
+        activity = serializer.save()
+        activity_hooks.activities_changed(added=[as_document(activity)], removed=[before])
+
+    def perform_destroy(self, instance):
+        before = as_document(instance)
+        instance.delete()
+        activity_hooks.activities_changed(removed=[before])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Validate a list of activities and insert the valid ones in one batch.
+
+        Returns one result per submitted item, in order: {"status": 201, "_id"}
+        for inserted items, {"status": 400, "errors"} for rejected ones.
+        """
+        items = request.data
+        limit = getattr(settings, 'OCTOFIT_BULK_MAX_ACTIVITIES', 1000)
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of activities.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > limit:
+            return Response({'detail': f'At most {limit} activities per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(items)
+        documents, positions = [], []
+        for position, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                results[position] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+                continue
+            document = {'distance': 0, 'notes': '', **serializer.validated_data}
+            document.pop('_id', None)
+            documents.append(document)
+            positions.append(position)
+
+        failed = {}
+        if documents:
+            try:
+                get_db().activities.insert_many(documents, ordered=False)
+            except BulkWriteError as exc:
+                failed = {error['index']: error['errmsg'] for error in exc.details['writeErrors']}
+
+        inserted = []
+        for index, (document, position) in enumerate(zip(documents, positions)):
+            if index in failed:
+                results[position] = {'status': status.HTTP_400_BAD_REQUEST,
+                                     'errors': {'non_field_errors': [failed[index]]}}
+            else:
+                results[position] = {'status': status.HTTP_201_CREATED, '_id': str(document['_id'])}
+                inserted.append(document)
+        if inserted:
+            activity_hooks.activities_changed(added=inserted)
+
+        all_created = len(inserted) == len(items)
+        return Response(results, status=status.HTTP_201_CREATED if all_created else status.HTTP_207_MULTI_STATUS)
 
+    @action(detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Stream activities oldest first as NDJSON or CSV.
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+        ?format=ndjson|csv, optional ?user_id=, ?start= and ?end= (ISO datetimes), ?fields=
+        """
+        criteria = {}
+        if request.query_params.get('user_id'):
+            criteria['user_id'] = request.query_params['user_id']
+        for param, operator in (('start', '$gte'), ('end', '$lt')):
+            value = _datetime_param(request, param)
+            if value is not None:
+                criteria.setdefault('date', {})[operator] = value
+
+        batch_size = getattr(settings, 'OCTOFIT_EXPORT_BATCH_SIZE', 1000)
+        fields = self.get_requested_fields()
+        documents = self.repository.find(criteria, sort=[('date', 1), ('_id', 1)], fields=fields)
+        rows = (self.repository.to_wire(document, fields) for document in documents.batch_size(batch_size))
+        renderer = request.accepted_renderer
+        if isinstance(renderer, CSVRenderer):
+            chunks = renderer.stream(rows, list(fields or self.repository.projection), batch_size)
+        else:
+            chunks = renderer.stream(rows, batch_size)
+        response = StreamingHttpResponse(chunks, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
+
+
+class LeaderboardViewSet(SparseFieldsViewMixin, NativeReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for leaderboard
+
+    Lists filter on ?team= and ?rank_min= / ?rank_max=
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    repository = Repository('leaderboard', LeaderboardSerializer)
+    keyset_ordering = ('rank', '_id')
+    query_filters = (
+        QueryFilter('team'),
+        QueryFilter('rank', 'rank_min', '$gte'),
+        QueryFilter('rank', 'rank_max', '$lte'),
+    )
+
+    def perform_create(self, serializer):
+        serializer.save()
+        self._invalidate()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self._invalidate()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        self._invalidate()
+
+    def _invalidate(self):
+        rank_index.invalidate()
+        leaderboard.team_standings_cache.invalidate()
+        leaderboard_stream.broadcaster.publish_reset()
+
+    @action(detail=False)
+    def top(self, request):
+        """
+        The k highest-ranked entries (?k=, optional ?team=)
+        """
+        k = _int_param(request, 'k', 10, maximum=100)
+        team = request.query_params.get('team')
+        return Response(self._ranked_rows(rank_index.top(k, team=team), team))
+
+    @action(detail=False, url_path=r'around/(?P<user_id>[^/.]+)')
+    def around(self, request, user_id=None):
+        """
+        Entries ranked within ?window= places of a user (optional ?team=)
+        """
+        window = _int_param(request, 'window', 5, maximum=50)
+        team = request.query_params.get('team')
+        entries = rank_index.around(user_id, window, team=team)
+        if entries is None:
+            raise NotFound('User is not on the leaderboard.')
+        return Response(self._ranked_rows(entries, team))
 
+    @action(detail=False)
+    def history(self, request):
+        """
+        The board as of the last snapshot at or before ?at= (ISO datetime, default now); ?team=, ?limit=
+        """
+        snapshot = leaderboard_history.board_at(_datetime_param(request, 'at'))
+        if snapshot is None:
+            raise NotFound('No leaderboard snapshot was taken by then.')
+        taken_at, rows = snapshot
+        team = request.query_params.get('team')
+        if team:
+            rows = [row for row in rows if row['team'] == team]
+        return Response({'taken_at': taken_at, 'results': rows[:_int_param(request, 'limit', 50, maximum=1000)]})
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+    @action(detail=False, url_path=r'history/(?P<user_id>[^/.]+)')
+    def user_history(self, request, user_id=None):
+        """
+        A user's rank and totals at every snapshot between ?start= and ?end= (ISO datetimes)
+        """
+        series = leaderboard_history.rank_series(
+            user_id, start=_datetime_param(request, 'start'), end=_datetime_param(request, 'end')
+        )
+        return Response({'user_id': user_id, 'results': series})
+
+    def _ranked_rows(self, entries, team):
+        fields = self.get_requested_fields()
+        documents = self.repository.find(
+            {'user_id': {'$in': [user_id for user_id, _, _ in entries]}},
+            fields=fields and fields + ('user_id',),
+        )
+        rows = {str(document['user_id']): document for document in documents}
+        entries = [entry for entry in entries if entry[0] in rows]
+        items = self.repository.to_wire_list([rows[user_id] for user_id, _, _ in entries], fields)
+        data = []
+        for (user_id, _, rank), item in zip(entries, items):
+            if team is None:
+                item['rank'] = rank
+            else:
+                item['rank'] = rank_index.rank_of(user_id)
+                item['team_rank'] = rank
+            data.append(item)
+        return data
+
+
+class WorkoutViewSet(CachedResponseMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint for workouts
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    keyset_ordering = ('name', '_id')
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        recommendations.workout_matrix.invalidate()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        recommendations.workout_matrix.invalidate()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        recommendations.workout_matrix.invalidate()
+
+
+def _datetime_param(request, name):
+    if not request.query_params.get(name):
+        return None
+    value = parse_datetime(request.query_params[name])
+    if value is None:
+        raise ValidationError({name: 'Expected an ISO 8601 datetime.'})
+    return value
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        value = default
+    return max(0, min(value, maximum))